@@ -1,57 +1,120 @@
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
 from matplotlib import cm
 
+from Instrumentation import instrument_module
+from Preprocessing import is_genomic_sorted
 from Utils import chromosome_sort
-from sklearn.cluster import DBSCAN
 
 
-def plot_manhattan(df, smooth_column):
+RASTER_MIN_POINTS = 100_000
+
+
+def _genome_coordinates(df):
+    """Cumulative genome positions, chromosome offsets and tick positions.
+
+    Chromosome sizes come from a single groupby; offsets are mapped onto the
+    rows in one vectorised step.
+    """
+    chrom = df["Chromosome"].astype(str)
+    sizes = df["Position"].astype("int64").groupby(chrom.to_numpy()).max()
+    sizes = sizes.reindex(sorted(sizes.index, key=chromosome_sort))
+    offsets = sizes.cumsum() - sizes
+
+    pos_cum = df["Position"].to_numpy(dtype="int64") + chrom.map(offsets).to_numpy(dtype="int64")
+    ticks = offsets + sizes / 2
+    return pos_cum, offsets, ticks
+
+
+def _draw_density(ax, x, y, colors, bin_edges_x, height_px):
+    """Draw points as a per-pixel density raster instead of individual markers.
+
+    *colors* gives one RGBA colour per x bin; pixel opacity grows with the
+    log of the number of points falling in it.
+    """
+    finite = np.isfinite(y)
+    x, y = x[finite], y[finite]
+    if len(y) == 0:
+        return
+    y_max = y.max() if y.max() > y.min() else y.min() + 1
+    counts, _, y_edges = np.histogram2d(x, y, bins=(bin_edges_x, np.linspace(y.min(), y_max, height_px + 1)))
+
+    image = np.repeat(colors[:, None, :], height_px, axis=1)
+    image[..., 3] = np.where(counts > 0, 0.3 + 0.7 * np.log1p(counts) / np.log1p(counts.max()), 0.0)
+
+    ax.imshow(
+        image.transpose(1, 0, 2),
+        extent=(bin_edges_x[0], bin_edges_x[-1], y_edges[0], y_edges[-1]),
+        origin="lower",
+        aspect="auto",
+        interpolation="nearest",
+    )
+
+
+def _finish_figure(fig, out_file, show, dpi):
+    if out_file:
+        fig.savefig(out_file, bbox_inches="tight", dpi=dpi)
+    if show:
+        plt.show()
+    elif out_file:
+        plt.close(fig)
+
+
+def plot_manhattan(df, smooth_column, *, threshold=None, raster=None, out_file=None, show=True, dpi=100):
     """Generates a Manhattan plot from a DataFrame.
 
     Args:
         df (pd.DataFrame): DataFrame containing the genomic data.
+        smooth_column (str): Column plotted on the y axis.
+        threshold (float, optional): Points at or above it are always drawn as markers.
+        raster (bool, optional): Draw the remaining points as a per-pixel density
+            raster. Defaults to True above RASTER_MIN_POINTS points.
+        out_file (str, optional): If given, saves the figure (PNG, PDF…).
+        show (bool): Call ``plt.show()``; use ``show=False`` with *out_file* for headless export.
+        dpi (int): Resolution of the figure and of the raster.
 
     Returns:
-        None: Displays the Manhattan plot using matplotlib.pyplot.
+        matplotlib.axes.Axes: The axes of the Manhattan plot.
     """
 
-    df = df.sort_values(["Chromosome", "Position"])
-    df["Chromosome"] = df["Chromosome"].astype(str)
-    df["Position"] = df["Position"].astype(int)
-
-    chrom_offsets = {}
-    current_offset = 0
-    sorted_chromosomes = sorted(df["Chromosome"].unique(), key=chromosome_sort)
+    if not is_genomic_sorted(df):
+        df = df.sort_values(["Chromosome", "Position"])
+    pos_cum, offsets, ticks = _genome_coordinates(df)
+    values = df[smooth_column].to_numpy(dtype=float)
 
-    for chrom in sorted_chromosomes:
-        chrom_offsets[chrom] = current_offset
-        max_pos = df[df["Chromosome"] == chrom]["Position"].max()
-        current_offset += max_pos
+    colors = plt.cm.plasma(np.linspace(0, 1, len(offsets)))
+    chrom_index = df["Chromosome"].astype(str).map({c: i for i, c in enumerate(offsets.index)}).to_numpy(dtype=int)
 
-    df["Pos_cum"] = df.apply(lambda row: row["Position"] + chrom_offsets[row["Chromosome"]], axis=1)
+    fig, ax = plt.subplots(figsize=(14, 6), dpi=dpi)
 
-    num_colors = len(df["Chromosome"].unique())
-    colors = plt.cm.plasma(np.linspace(0, 1, num_colors))
+    if raster is None:
+        raster = len(df) > RASTER_MIN_POINTS
+    marked = np.ones(len(df), dtype=bool) if not raster else (
+        values >= threshold if threshold is not None else np.zeros(len(df), dtype=bool)
+    )
 
-    chrom_color_map = {chrom: colors[i] for i, chrom in enumerate(sorted_chromosomes)}
-    df["Color"] = df["Chromosome"].map(chrom_color_map)
+    if raster:
+        width_px = int(fig.get_figwidth() * dpi)
+        edges = np.linspace(pos_cum.min(), pos_cum.max() + 1, width_px + 1)
+        bin_chrom = np.searchsorted(offsets.to_numpy(), (edges[:-1] + edges[1:]) / 2, side="right") - 1
+        _draw_density(ax, pos_cum[~marked], values[~marked], colors[bin_chrom], edges, int(fig.get_figheight() * dpi))
 
-    plt.figure(figsize=(14, 6))
-    plt.scatter(df["Pos_cum"], df[smooth_column], c=df["Color"], edgecolor=df["Color"], alpha=0.5)
+    point_colors = colors[chrom_index[marked]]
+    ax.scatter(pos_cum[marked], values[marked], c=point_colors, edgecolor=point_colors, alpha=0.5)
 
-    for chrom in chrom_offsets.values():
-        plt.axvline(x=chrom, color='grey', linestyle='--', alpha=0.5)
+    for offset in offsets:
+        ax.axvline(x=offset, color='grey', linestyle='--', alpha=0.5)
 
-    chrom_ticks = {chrom_offsets[chrom] + (df[df["Chromosome"] == chrom]["Pos_cum"].max() - chrom_offsets[chrom]) / 2: chrom for chrom in chrom_offsets.keys()}
-    plt.xticks(list(chrom_ticks.keys()), list(chrom_ticks.values()))
+    ax.set_xticks(ticks.to_numpy(), ticks.index)
 
-    plt.xlabel("Position on genome")
-    plt.ylabel("-log10(p-value)")
+    ax.set_xlabel("Position on genome")
+    ax.set_ylabel("-log10(p-value)")
 
-    plt.show()
+    _finish_figure(fig, out_file, show, dpi)
+    return ax
 
 def plot_bootstrap_mean_with_CI(df):
     """
@@ -133,19 +196,28 @@ def plot_bootstrap_violon(df):
 
     plt.show()
 
-def plot_manhattan2(df, snr_filtered):
+def plot_manhattan2(df, snr_filtered, *, raster=None, out_file=None, show=True, dpi=100, index=None):
     """
     Generates a modified Manhattan plot highlighting points based on SNR.
 
     The 'snr_filtered' DataFrame should contain a 'Predictor' column with the identifiers
-    of the points that should be highlighted (e.g., those with high Signal-to-Noise Ratio).
+    of the points that should be highlighted (e.g., those with high Signal-to-Noise Ratio),
+    or a 'Gene Name' column (e.g., the top rows of signal_noise_all_genes) to highlight
+    every CpG of those genes.
 
     Args:
         df (pd.DataFrame): DataFrame containing the genomic data.
-        snr_filtered (pd.DataFrame): DataFrame containing 'Predictor' values to highlight.
+        snr_filtered (pd.DataFrame): DataFrame containing 'Predictor' or 'Gene Name' values to highlight.
+        raster (bool, optional): Draw the non-highlighted points as a per-pixel density
+            raster. Defaults to True above RASTER_MIN_POINTS points.
+        out_file (str, optional): If given, saves the figure (PNG, PDF…).
+        show (bool): Call ``plt.show()``; use ``show=False`` with *out_file* for headless export.
+        dpi (int): Resolution of the figure and of the raster.
+        index (GenomicIndex, optional): Index built from *df*; highlighted rows are
+            looked up in it instead of scanning the whole frame.
 
     Returns:
-        None: Displays the modified Manhattan plot using matplotlib.pyplot.
+        matplotlib.axes.Axes: The axes of the Manhattan plot.
 
     Example:
         >>> s = savgol_smoothing(df_merged, 17,2)
@@ -156,38 +228,49 @@ def plot_manhattan2(df, snr_filtered):
 
     plt.rcParams['font.family'] = 'Arial'
 
-    df = df.sort_values(["Chromosome", "Position"])
-    df["Chromosome"] = df["Chromosome"].astype(str)
-    df["Position"] = df["Position"].astype(int)
-
-    # Position cumulative
-    chrom_offsets = {}
-    current_offset = 0
-    sorted_chromosomes = sorted(df["Chromosome"].unique(), key=chromosome_sort)
-
-    for chrom in sorted_chromosomes:
-        chrom_offsets[chrom] = current_offset
-        max_pos = df[df["Chromosome"] == chrom]["Position"].max()
-        current_offset += max_pos
+    if index is not None:
+        index.check(df)
+        if "Predictor" in snr_filtered.columns:
+            highlighted = index.mask(index.ids(snr_filtered["Predictor"]))
+        else:
+            highlighted = index.mask(index.genes(snr_filtered["Gene Name"]))
+    elif "Predictor" in snr_filtered.columns:
+        highlighted = df["Predictor"].isin(snr_filtered["Predictor"]).to_numpy()
+    else:
+        highlighted = df["Gene Name"].isin(snr_filtered["Gene Name"]).to_numpy()
 
-    df["Pos_cum"] = df.apply(lambda row: row["Position"] + chrom_offsets[row["Chromosome"]], axis=1)
+    if not is_genomic_sorted(df) and (index is None or not index.is_sorted):
+        df = df.assign(is_high_snr=highlighted).sort_values(["Chromosome", "Position"])
+        highlighted = df["is_high_snr"].to_numpy()
 
-    df["is_high_snr"] = df["Predictor"].isin(snr_filtered["Predictor"])
+    # Position cumulative
+    pos_cum, offsets, ticks = _genome_coordinates(df)
+    values = df["smooth_result"].to_numpy(dtype=float)
+    is_high_snr = highlighted
 
-    plt.figure(figsize=(14, 6))
+    fig, ax = plt.subplots(figsize=(14, 6), dpi=dpi)
 
     # Points normaux (gris)
-    plt.scatter(
-        df.loc[~df["is_high_snr"], "Pos_cum"],
-        df.loc[~df["is_high_snr"], "smooth_result"],
-        color="lightgray",
-        alpha=0.5,
-        label="Noise"
-    )
+    if raster is None:
+        raster = len(df) > RASTER_MIN_POINTS
+    if raster:
+        width_px = int(fig.get_figwidth() * dpi)
+        edges = np.linspace(pos_cum.min(), pos_cum.max() + 1, width_px + 1)
+        gray = np.tile(matplotlib.colors.to_rgba("lightgray"), (width_px, 1))
+        _draw_density(ax, pos_cum[~is_high_snr], values[~is_high_snr], gray, edges, int(fig.get_figheight() * dpi))
+        ax.scatter([], [], color="lightgray", alpha=0.5, label="Noise")
+    else:
+        ax.scatter(
+            pos_cum[~is_high_snr],
+            values[~is_high_snr],
+            color="lightgray",
+            alpha=0.5,
+            label="Noise"
+        )
 
-    high_snr_df = df.loc[df["is_high_snr"]].copy()
-    gene_series = high_snr_df["Gene Name"].astype(str)
-    unique_genes = sorted(gene_series[gene_series != 'nan'].unique().tolist())
+    high_snr_df = df.loc[is_high_snr]
+    gene_series = high_snr_df["Gene Name"].dropna().astype(str)
+    unique_genes = sorted(gene_series.unique().tolist())
     all_genes_label = ", ".join(unique_genes)
 
     if not high_snr_df.empty:
@@ -197,40 +280,37 @@ def plot_manhattan2(df, snr_filtered):
     else:
         position_label = ""
 
-    plt.scatter(
-        high_snr_df["Pos_cum"],
-        high_snr_df["smooth_result"],
+    ax.scatter(
+        pos_cum[is_high_snr],
+        values[is_high_snr],
         color="crimson",
         alpha=0.9,
         label=f"{all_genes_label}{position_label}"
     )
 
-    for chrom in chrom_offsets.values():
-        plt.axvline(x=chrom, color='grey', linestyle='--', alpha=0.3)
+    for offset in offsets:
+        ax.axvline(x=offset, color='grey', linestyle='--', alpha=0.3)
 
     # Ticks pour les chromosomes
-    chrom_ticks = {
-        chrom_offsets[chrom] + (df[df["Chromosome"] == chrom]["Pos_cum"].max() - chrom_offsets[chrom]) / 2: chrom
-        for chrom in chrom_offsets
-    }
-    plt.yticks(fontsize=17)
-    plt.xticks(list(chrom_ticks.keys()), list(chrom_ticks.values()), fontsize=17)
+    ax.tick_params(axis='y', labelsize=17)
+    ax.set_xticks(ticks.to_numpy(), ticks.index, fontsize=17)
 
 
 
-    plt.xlabel("Chromosomes", fontsize=19, labelpad=17)
-    plt.ylabel("-log10(p-value)", fontsize=19)
+    ax.set_xlabel("Chromosomes", fontsize=19, labelpad=17)
+    ax.set_ylabel("-log10(p-value)", fontsize=19)
     sns.despine(top=True, right=True)
 
-    plt.legend(
+    ax.legend(
         bbox_to_anchor=(0, 1.1),
         loc='lower left',
         borderaxespad=0.,
         fontsize = 17
     )
 
-    plt.tight_layout()
-    plt.show()
+    fig.tight_layout()
+    _finish_figure(fig, out_file, show, dpi)
+    return ax
 
 
 def plot_volcano(
@@ -304,3 +384,6 @@ def plot_anova_volcano(stats: pd.DataFrame):
     plt.ylabel("log10(BF10)")
     plt.legend()
     plt.show()
+
+
+instrument_module(__name__)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+
+class GenomicIndex:
+    """Sorted lookup tables over the rows of a merged methylome frame.
+
+    Built once from the output of ``Preprocessing.merge``, it answers region,
+    gene and probe ID queries with ``searchsorted`` on presorted arrays instead
+    of a boolean scan of the whole frame. Results are row positions
+    (``iloc``) in the frame the index was built from, so the frame must not be
+    reordered afterwards. Rows without a ``Chromosome`` or ``Position`` (probes
+    missing from the manifest in a left merge) are left out of the region
+    queries, and rows without a gene or probe ID out of those lookups.
+
+    Example:
+        >>> index = GenomicIndex(df_merged)
+        >>> rows = index.region("7", 27_000_000, 27_300_000)
+        >>> df_merged.iloc[index.gene("MMACHC")]
+    """
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+
+        placed = np.flatnonzero(df["Chromosome"].notna().to_numpy() & df["Position"].notna().to_numpy())
+        self.n_unplaced = self.n_rows - len(placed)
+        chrom_codes, chromosomes = pd.factorize(df["Chromosome"].iloc[placed].astype(str))
+        positions = df["Position"].iloc[placed].to_numpy(dtype=float).astype(np.int64)
+        order = np.lexsort((positions, chrom_codes))
+        self._position_order = placed[order]
+        self._sorted_positions = positions[order]
+        chrom_starts = np.concatenate(([0], np.cumsum(np.bincount(chrom_codes, minlength=len(chromosomes)))))
+        self._chromosomes = {
+            chrom: (chrom_starts[i], chrom_starts[i + 1]) for i, chrom in enumerate(chromosomes)
+        }
+        self.is_sorted = not self.n_unplaced and bool(np.all(self._position_order == np.arange(self.n_rows)))
+
+        self._gene_rows = np.array([], dtype=np.int64)
+        self._genes = {}
+        if "Gene Name" in df.columns:
+            gene_codes, genes = pd.factorize(df["Gene Name"])
+            annotated = np.flatnonzero(gene_codes >= 0)
+            self._gene_rows = annotated[np.argsort(gene_codes[annotated], kind="stable")]
+            gene_starts = np.concatenate(([0], np.cumsum(np.bincount(gene_codes[annotated], minlength=len(genes)))))
+            self._genes = {gene: (gene_starts[i], gene_starts[i + 1]) for i, gene in enumerate(genes)}
+
+        self._id_order = None
+        if "Predictor" in df.columns:
+            identified = np.flatnonzero(df["Predictor"].notna().to_numpy())
+            ids = df["Predictor"].iloc[identified].astype(str).to_numpy(dtype=object)
+            order = np.argsort(ids, kind="stable")
+            self._id_order = identified[order]
+            self._sorted_ids = ids[order]
+
+    def check(self, df):
+        """Raise if *df* cannot be the frame this index was built from."""
+        if len(df) != self.n_rows:
+            raise ValueError("GenomicIndex was built from a frame with a different number of rows.")
+
+    @property
+    def chromosomes(self):
+        return list(self._chromosomes)
+
+    def bounds(self):
+        """Row offsets of the chromosome segments, as ``Smoothing.chromosome_bounds``.
+
+        Only defined when the frame is sorted by chromosome and position.
+        """
+        if self.n_unplaced:
+            raise ValueError(
+                f"{self.n_unplaced} rows have no Chromosome or Position; drop them or use "
+                "Preprocessing.normalize_methylome first."
+            )
+        if not self.is_sorted:
+            raise ValueError("Chromosome bounds need a frame sorted by Chromosome and Position.")
+        return np.array([0] + [hi for _, hi in self._chromosomes.values()], dtype=np.int64)
+
+    def region(self, chrom, start=None, end=None):
+        """Rows on *chrom* with ``start <= Position <= end``, in position order."""
+        lo, hi = self._chromosomes.get(str(chrom), (0, 0))
+        positions = self._sorted_positions[lo:hi]
+        a = 0 if start is None else np.searchsorted(positions, start, side="left")
+        b = len(positions) if end is None else np.searchsorted(positions, end, side="right")
+        return self._position_order[lo + a:lo + b]
+
+    def chromosome_max(self, chrom):
+        """Largest position on *chrom*."""
+        lo, hi = self._chromosomes[str(chrom)]
+        return self._sorted_positions[hi - 1]
+
+    def gene(self, gene):
+        """Rows annotated to *gene*, in frame order."""
+        lo, hi = self._genes.get(gene, (0, 0))
+        return self._gene_rows[lo:hi]
+
+    def genes(self, genes):
+        """Rows annotated to any of *genes*, in frame order."""
+        parts = [self.gene(gene) for gene in pd.unique(pd.Series(genes).dropna())]
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+    def ids(self, predictors):
+        """Rows of the given probe IDs; IDs absent from the frame are skipped."""
+        if self._id_order is None:
+            raise ValueError("GenomicIndex was built from a frame without a 'Predictor' column.")
+        queries = pd.Series(predictors).dropna().astype(str).to_numpy(dtype=object)
+        left = np.searchsorted(self._sorted_ids, queries, side="left")
+        counts = np.searchsorted(self._sorted_ids, queries, side="right") - left
+        # Expand each [left, right) range; IDs are usually unique so counts are 0 or 1.
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.sort(self._id_order[np.repeat(left, counts) + within])
+
+    def mask(self, rows):
+        """Boolean mask over the frame with *rows* set."""
+        out = np.zeros(self.n_rows, dtype=bool)
+        out[rows] = True
+        return out
@@ -0,0 +1,281 @@
+"""Opt-in timing and memory instrumentation of the pipeline stages.
+
+The public functions of the instrumented modules (``Microarray_handler``,
+``Preprocessing``, ``Maths``, ``Smoothing``, ``SNR_tools``, ``Peaks``,
+``Utils`` and ``Display``) are wrapped only while instrumentation is active,
+so a disabled run executes the original functions untouched. It is switched
+on either
+
+* for a whole process, by setting ``SMOOTHED_METHYLOME_PROFILE`` before the
+  modules are imported: ``1`` prints a summary at exit, a path ending in
+  ``.json`` or ``.csv`` exports the spans there;
+* for a block of code, with the :func:`profiling` context manager.
+
+Every call becomes a span holding its wall time, the growth of the process
+peak RSS, optionally the peak ``tracemalloc`` allocation, the number of rows
+processed and the resulting rows per second. Calls made inside another
+instrumented call (or inside a :func:`span`) are recorded as its children.
+
+Example:
+    >>> import Instrumentation
+    >>> with Instrumentation.profiling(trace_memory=True) as spans:
+    ...     stats = run_methylation_ttest(df1, df2)
+    ...     with Instrumentation.span("smoothing", rows=len(df_merged)):
+    ...         savgol_smoothing(df_merged, "log10_pvalue", 11, 2)
+    >>> spans.export("profile.json")
+"""
+import atexit
+import csv
+import functools
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENV_VAR = "SMOOTHED_METHYLOME_PROFILE"
+
+FIELDS = (
+    "id", "parent", "depth", "name", "path", "start", "wall_s",
+    "rss_peak_delta_mib", "traced_peak_mib", "rows", "rows_per_s", "error",
+)
+
+
+class Recorder:
+    """Collected spans of one profiling session."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, rows=None):
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        record = {
+            "id": None,
+            "parent": parent["id"] if parent else None,
+            "depth": len(stack),
+            "name": name,
+            "path": f"{parent['path']}/{name}" if parent else name,
+            "start": time.perf_counter() - self._origin,
+            "rows": rows,
+            "error": None,
+            "_peak": 0,
+        }
+        with self._lock:
+            record["id"] = len(self.spans)
+            self.spans.append(record)
+
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            for frame in stack:
+                frame["_peak"] = max(frame["_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_start_traced"] = current
+        rss_before = _max_rss()
+
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as error:
+            record["error"] = type(error).__name__
+            raise
+        finally:
+            record["wall_s"] = time.perf_counter() - start
+            stack.pop()
+            record["rss_peak_delta_mib"] = (_max_rss() - rss_before) / 2 ** 20 if resource else None
+            record["traced_peak_mib"] = None
+            if tracing:
+                peak = max(record["_peak"], tracemalloc.get_traced_memory()[1])
+                record["traced_peak_mib"] = (peak - record["_start_traced"]) / 2 ** 20
+                if stack:
+                    stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+            rows = record["rows"]
+            record["rows_per_s"] = rows / record["wall_s"] if rows and record["wall_s"] > 0 else None
+
+    def records(self):
+        """Finished spans as plain dictionaries, in start order."""
+        return [{field: span.get(field) for field in FIELDS} for span in self.spans if "wall_s" in span]
+
+    def summary(self):
+        """Total time, calls and rows per span path, as a DataFrame."""
+        import pandas as pd
+
+        frame = pd.DataFrame(self.records(), columns=FIELDS)
+        summary = frame.groupby("path", sort=False).agg(
+            calls=("id", "size"),
+            wall_s=("wall_s", "sum"),
+            rows=("rows", "sum"),
+            rss_peak_delta_mib=("rss_peak_delta_mib", "max"),
+            traced_peak_mib=("traced_peak_mib", "max"),
+        )
+        summary["rows_per_s"] = summary["rows"] / summary["wall_s"]
+        return summary
+
+    def export(self, path):
+        """Write the spans to *path* as JSON or CSV, chosen by its suffix."""
+        path = pathlib.Path(path)
+        records = self.records()
+        if path.suffix.lower() == ".csv":
+            with path.open("w", newline="") as fh:
+                writer = csv.DictWriter(fh, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            path.write_text(json.dumps(records, indent=1))
+        return path
+
+
+def _max_rss():
+    """Peak resident set size of the process in bytes."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _rows_of(value):
+    """Number of rows of a frame/array, or of the frames in a tuple."""
+    if isinstance(value, (tuple, list)):
+        counts = [_rows_of(item) for item in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    shape = getattr(value, "shape", None)
+    if shape:
+        return int(shape[0])
+    return None
+
+
+_registered = {}   # module name -> names excluded from instrumentation
+_originals = {}    # (module name, attribute) -> original function
+_recorder = None
+
+
+def _wrap(func, recorder):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        rows = next((n for n in map(_rows_of, args[:1]) if n is not None), None)
+        with recorder.span(func.__name__, rows=rows) as record:
+            result = func(*args, **kwargs)
+            if record["rows"] is None:
+                record["rows"] = _rows_of(result)
+            return result
+
+    wrapper.__instrumented__ = func
+    return wrapper
+
+
+def _install(recorder):
+    modules = {name: sys.modules[name] for name in _registered if name in sys.modules}
+    wrappers = {}
+    for name, module in modules.items():
+        for attr, value in list(vars(module).items()):
+            if (
+                attr.startswith("_") or attr in _registered[name] or not callable(value)
+                or isinstance(value, type) or getattr(value, "__module__", None) != name
+                or hasattr(value, "__instrumented__")
+            ):
+                continue
+            wrappers[id(value)] = (value, _wrap(value, recorder))
+
+    # Rebind in every instrumented module, including names imported with ``from X import f``.
+    for name, module in modules.items():
+        for attr, value in list(vars(module).items()):
+            if id(value) in wrappers and wrappers[id(value)][0] is value:
+                _originals[(name, attr)] = value
+                setattr(module, attr, wrappers[id(value)][1])
+
+
+def _uninstall():
+    for (name, attr), func in _originals.items():
+        setattr(sys.modules[name], attr, func)
+    _originals.clear()
+
+
+def instrument_module(name, skip=()):
+    """Register module *name* for instrumentation (call at the end of the module).
+
+    Functions listed in *skip* are left alone, e.g. sort keys called once per
+    element. If instrumentation is already active the module is wrapped now.
+    """
+    _registered[name] = set(skip)
+    if _recorder is not None:
+        _install(_recorder)
+
+
+@contextmanager
+def profiling(trace_memory=False, output=None):
+    """Instrument the registered modules for the duration of the block.
+
+    Yields the :class:`Recorder`; with *output*, its spans are exported there
+    (``.json`` or ``.csv``) on exit. *trace_memory* starts ``tracemalloc`` for
+    the block, which slows allocation-heavy code down noticeably.
+    """
+    global _recorder
+    if _recorder is not None:  # already on, e.g. through the environment variable
+        yield _recorder
+        if output is not None:
+            _recorder.export(output)
+        return
+
+    recorder = Recorder(trace_memory=trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _recorder = recorder
+    _install(recorder)
+    try:
+        yield recorder
+    finally:
+        _uninstall()
+        _recorder = None
+        if started_tracing:
+            tracemalloc.stop()
+        if output is not None:
+            recorder.export(output)
+
+
+def span(name, rows=None):
+    """Record a user-defined span; does nothing when instrumentation is off."""
+    if _recorder is None:
+        return _null_span()
+    return _recorder.span(name, rows=rows)
+
+
+@contextmanager
+def _null_span():
+    yield {}
+
+
+def _report_at_exit(recorder, target):
+    if target.lower().endswith((".json", ".csv")):
+        recorder.export(target)
+    else:
+        print(recorder.summary().to_string())
+
+
+_target = os.environ.get(ENV_VAR, "").strip()
+if _target and _target.lower() not in ("0", "false", "no"):
+    _recorder = Recorder(trace_memory=os.environ.get(f"{ENV_VAR}_MEMORY") == "1")
+    if _recorder.trace_memory:
+        tracemalloc.start()
+    atexit.register(_report_at_exit, _recorder, _target)
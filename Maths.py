@@ -1,84 +1,258 @@
-from typing import Iterable
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from itertools import repeat
+from functools import partial
+from typing import Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 
-from SNR_tools import signal_noise_for_gene
-from Smoothing import mean_smoothing, savgol_smoothing
-from scipy.stats import ttest_ind
-from statsmodels.stats.multitest import multipletests
+from Instrumentation import instrument_module
+from Peaks import call_peaks, peak_maxima
+from SNR_tools import bootstrap_signal_noise, gene_mask, rolling_signal, signal_noise_from_mask
+from Smoothing import chromosome_bounds, genomic_order, smooth_bank, smooth_matrix
 
-def bootstrap_distribution(df, gene, smooth_column, windows_size=20, n_iterations=1000):
+def bootstrap_distribution(df, gene, smooth_column, windows_size=20, n_iterations=1000, seed=None):
     results = []
 
-    for n in range(1, windows_size, 2):
-        smoothed_df = mean_smoothing(df.copy(), n)
+    grid = [('mean', n, 0) for n in range(1, windows_size, 2)]
+    smoothed = smooth_bank(df[smooth_column].to_numpy(dtype=float), chromosome_bounds(df), grid)
+    mask = gene_mask(df, gene)
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
 
-        signal_noise_bootstraps = []
-        for _ in range(n_iterations):
-            ratio = signal_noise_for_gene(smoothed_df, gene=gene, bootstrap=True)
-            signal_noise_bootstraps.append(ratio)
+    for k, (_, n, _) in enumerate(grid):
+        boot = bootstrap_signal_noise(smoothed[:, k], mask, n_bootstrap=n_iterations, seed=seeds[k])
 
         results.append({
             'n': n,
-            'signal_noise_bootstraps': signal_noise_bootstraps
+            'signal_noise_bootstraps': boot['distribution'].tolist()
         })
 
     return pd.DataFrame(results)
 
-def bootstrap_mean_with_CI(df, gene, target_column, windows_size=20):
+def savgol_grid(max_n=101, max_order=10):
+    """(method, n, order) grid explored by :func:`Utils.savgol_looker`."""
+    return [("savgol", n, order) for n in range(3, max_n, 2) for order in range(1, min(n, max_order))]
+
+
+def _sweep_chunk(values, bounds, mask, specs):
+    return signal_noise_from_mask(smooth_bank(values, bounds, specs), mask)
+
+
+def smoothing_sweep(df, target_column, gene, grid=None, *, n_jobs=None, chunk_size=16):
+    """Signal-to-noise ratio of *gene* for every smoother of a parameter grid.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Merged frame with ``Chromosome``, ``Gene Name`` and *target_column*,
+        grouped by chromosome.
+    target_column : str
+        Column to smooth.
+    gene : str
+        Gene whose rows make up the signal; all other rows are the noise.
+    grid : sequence of (method, n, order), optional
+        Smoothers to evaluate (see :func:`Smoothing.kernel_bank`). Defaults to
+        :func:`savgol_grid`.
+    n_jobs : int, optional
+        If greater than 1, chunks of the grid are spread over a process pool.
+    chunk_size : int
+        Number of smoothers evaluated together; bounds the
+        ``len(df) × chunk_size`` block held in memory.
+
+    Returns
+    -------
+    DataFrame
+        One row per grid point with columns ``method, n, order, signal_noise``.
+    """
+    grid = list(savgol_grid() if grid is None else grid)
+    values = df[target_column].to_numpy(dtype=float)
+    bounds = chromosome_bounds(df)
+    mask = gene_mask(df, gene)
+
+    chunks = [grid[i:i + chunk_size] for i in range(0, len(grid), chunk_size)]
+    if n_jobs is not None and n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            ratios = list(pool.map(_sweep_chunk, repeat(values), repeat(bounds), repeat(mask), chunks))
+    else:
+        ratios = [_sweep_chunk(values, bounds, mask, chunk) for chunk in chunks]
+
+    return pd.DataFrame({
+        'method': [method for method, _, _ in grid],
+        'n': [n for _, n, _ in grid],
+        'order': [order for _, _, order in grid],
+        'signal_noise': np.concatenate(ratios) if ratios else np.array([]),
+    })
+
+
+def bootstrap_mean_with_CI(df, gene, target_column, windows_size=20, chunk_size=16, seed=None):
     results = []
 
-    smoothing_methods = [
-        {
-            'name': 'mean',
-            'orders': [0],
-            'window_range': range(1, windows_size, 2),
-            'apply': lambda df_copy,target_column, n, order: mean_smoothing(df_copy.copy(),target_column, n)
-        },
-        {
-            'name': 'savgol',
-            'orders': [1, 2, 4],
-            'window_range': range(3, windows_size, 2),
-            'apply': lambda df_copy,target_column, n, order: savgol_smoothing(df_copy.copy(), target_column, n, order)
-        }
+    grid = [('mean', n, 0) for n in range(1, windows_size, 2)]
+    grid += [
+        ('savgol', n, order)
+        for order in (1, 2, 4)
+        for n in range(3, windows_size, 2)
+        if n > order
     ]
 
-    for method in smoothing_methods:
-        for order in method['orders']:
-            for n in method['window_range']:
-                if method['name'] == 'savgol' and n <= order:
-                    continue
-                smoothed_df = method['apply'](df, target_column, n, order)
-
-                mean_bootstrap, conf_interval = bootstrap_with_confidence(
-                    smoothed_df, gene, 'smooth_result'
-                )
-
-                results.append({
-                    'n': n,
-                    'order': order,
-                    'method': method['name'],
-                    'signal_noise_mean': mean_bootstrap,
-                    'conf_lower': conf_interval[0],
-                    'conf_upper': conf_interval[1]
-                })
+    values = df[target_column].to_numpy(dtype=float)
+    bounds = chromosome_bounds(df)
+    mask = gene_mask(df, gene)
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+
+    for i in range(0, len(grid), chunk_size):
+        chunk = grid[i:i + chunk_size]
+        smoothed = smooth_bank(values, bounds, chunk)
+
+        for k, (method, n, order) in enumerate(chunk):
+            boot = bootstrap_signal_noise(
+                smoothed[:, k], mask, noise_percentage=0.10, n_bootstrap=20, seed=seeds[i + k]
+            )
+
+            results.append({
+                'n': n,
+                'order': order,
+                'method': method,
+                'signal_noise_mean': boot['mean'],
+                'conf_lower': boot['conf_interval'][0],
+                'conf_upper': boot['conf_interval'][1]
+            })
 
     result_df = pd.DataFrame(results)
 
 
     return result_df
 
-def bootstrap_with_confidence(df, gene, smooth_column, noise_percentage=0.10, n_bootstrap=20):
+def bootstrap_with_confidence(df, gene, smooth_column, noise_percentage=0.10, n_bootstrap=20, seed=None):
 
-    bootstrap_samples = [
-        signal_noise_for_gene(df, gene, smooth_column, True, noise_percentage) for _ in range(n_bootstrap)
-    ]
+    boot = bootstrap_signal_noise(
+        df[smooth_column].to_numpy(dtype=float),
+        gene_mask(df, gene),
+        noise_percentage,
+        n_bootstrap,
+        seed=seed,
+    )
+
+    return boot['mean'], boot['conf_interval']
 
-    mean_value = np.mean(bootstrap_samples)
-    conf_interval = np.percentile(bootstrap_samples, [2.5, 97.5])
+def _row_moments(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """NaN‑aware per‑row count, mean and unbiased variance of a 2‑D array."""
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=1)
+    filled = np.where(valid, values, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=1) / n
+        centred = np.where(valid, values - mean[:, None], 0.0)
+        var = (centred ** 2).sum(axis=1) / (n - 1)
+
+    return n, mean, var
+
+
+def _welch_ttest(
+    g1: np.ndarray,
+    g2: np.ndarray,
+    min_n: int = 2,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Row‑wise Welch t‑test between two CpG × samples arrays.
+
+    Returns the two group means and the two‑sided p‑values. Rows where either
+    group has fewer than *min_n* non‑missing values get a NaN p‑value.
+    """
+    from scipy.stats import t as t_dist  # scipy.stats is slow to import; load it on first use
+
+    n1, mean1, var1 = _row_moments(g1)
+    n2, mean2, var2 = _row_moments(g2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        se1 = var1 / n1
+        se2 = var2 / n2
+        denom = np.sqrt(se1 + se2)
+        t = (mean1 - mean2) / denom
+        dof = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        pvals = 2.0 * t_dist.sf(np.abs(t), dof)
+
+    pvals[(n1 < max(min_n, 2)) | (n2 < max(min_n, 2))] = np.nan
+    return mean1, mean2, pvals
+
+
+_DEFAULT_CHUNK_MEMORY = 256 * 1024 ** 2
+
+
+def _chunk_rows(n_cols: int, memory_budget: int) -> int:
+    """Rows per chunk so that a chunk and its float64 temporaries fit the budget."""
+    return max(1, int(memory_budget // (max(n_cols, 1) * 8 * 6)))
+
+
+def _take_rows(values: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Read *positions* from a (possibly memory‑mapped) array as float64."""
+    if len(positions) and positions[-1] - positions[0] == len(positions) - 1 and np.all(np.diff(positions) == 1):
+        return np.asarray(values[positions[0]:positions[-1] + 1], dtype=float)
+    return np.asarray(values[positions], dtype=float)
+
+
+def _map_row_chunks(
+    frames: Sequence[pd.DataFrame],
+    common: pd.Index,
+    func,
+    args: tuple = (),
+    *,
+    memory_budget: int = _DEFAULT_CHUNK_MEMORY,
+    n_jobs: int | None = None,
+    progress: bool | str = False,
+) -> Tuple[np.ndarray, ...]:
+    """Apply ``func(g1, g2, ..., *args)`` to row chunks of the CpGs in *common*.
+
+    The matrices are read chunk by chunk straight from the frames' arrays, so
+    memory‑mapped inputs never have to be loaded whole. Each call returns a
+    tuple of per‑row arrays, written into preallocated outputs as chunks
+    complete. With ``n_jobs > 1`` chunks run on a process pool with at most
+    ``2 * n_jobs`` of them in flight.
+    """
+    values = [frame.to_numpy() for frame in frames]
+    positions = [frame.index.get_indexer(common) for frame in frames]
+    if not len(common):  # no chunk would run; an empty one still gives the outputs their dtypes
+        return func(*(np.empty((0, block.shape[1])) for block in values), *args)
+
+    step = _chunk_rows(sum(block.shape[1] for block in values), memory_budget)
+    starts = range(0, len(common), step)
+    if progress:
+        try:
+            from tqdm import tqdm
+
+            desc = progress if isinstance(progress, str) else func.__name__
+            starts = tqdm(starts, desc=desc)
+        except ModuleNotFoundError:
+            print("[_map_row_chunks] tqdm not installed – running without progress bar")
+
+    outputs: list[np.ndarray] = []
+
+    def collect(lo: int, result: Tuple[np.ndarray, ...]) -> None:
+        if not outputs:
+            outputs.extend(np.empty(len(common), dtype=part.dtype) for part in result)
+        for out, part in zip(outputs, result):
+            out[lo:lo + len(part)] = part
+
+    def load(lo: int) -> Tuple[np.ndarray, ...]:
+        return tuple(_take_rows(block, pos[lo:lo + step]) for block, pos in zip(values, positions))
+
+    if n_jobs is not None and n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            pending = {}
+            for lo in starts:
+                pending[pool.submit(func, *load(lo), *args)] = lo
+                if len(pending) >= 2 * n_jobs:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(pending.pop(future), future.result())
+            for future in as_completed(pending):
+                collect(pending[future], future.result())
+    else:
+        for lo in starts:
+            collect(lo, func(*load(lo), *args))
+
+    return tuple(outputs)
 
-    return mean_value, conf_interval
 
 def run_methylation_ttest(
     df1: pd.DataFrame,
@@ -88,71 +262,571 @@ def run_methylation_ttest(
     name2: str = "group2",
     min_n: int = 2,
     progress: bool = True,
+    memory_budget: int = _DEFAULT_CHUNK_MEMORY,
+    n_jobs: int | None = None,
 ) -> pd.DataFrame:
+    """Per‑CpG Welch t‑test between two groups of β‑values.
+
+    The test is computed on whole row chunks of the underlying arrays;
+    missing values are ignored row by row. Memory‑mapped inputs (e.g. from
+    ``build_methylome_dataframes(cache_dir=...)``) are read chunk by chunk.
+
+    Parameters
+    ----------
+    df1, df2 : DataFrame
+        CpG × samples matrices (index = CpG IDs).
+    name1, name2 : str
+        Labels used to name the mean columns.
+    min_n : int
+        Minimum number of non‑missing values required in each group; CpGs
+        below it get a NaN p‑value.
+    progress : bool
+        Show a progress bar over the chunks of CpGs (requires ``tqdm``).
+    memory_budget : int
+        Approximate bytes of working memory per chunk of CpGs.
+    n_jobs : int, optional
+        If greater than 1, chunks are processed on a process pool.
+
+    Returns
+    -------
+    DataFrame
+        Columns: ``<name1>_mean, <name2>_mean, delta, pvalue, qvalue`` with
+        CpG IDs as index.
+    """
     common = df1.index.intersection(df2.index)
-    g1 = df1.loc[common]
-    g2 = df2.loc[common]
 
-    mean1 = g1.mean(axis=1, skipna=True)
-    mean2 = g2.mean(axis=1, skipna=True)
-    delta = mean2 - mean1
+    mean1, mean2, pvals = _map_row_chunks(
+        (df1, df2), common, _welch_ttest, (min_n,),
+        memory_budget=memory_budget, n_jobs=n_jobs, progress=progress,
+    )
 
-    iterator = common
-    bar_close = lambda: None  # default no‑op
-    try:
-        from tqdm import tqdm  # type: ignore
-        iterator = tqdm(common, desc="run_methylation_ttest", unit="CpG")
-        bar_close = iterator.close
-    except ModuleNotFoundError:
-        print("[run_methylation_ttest] tqdm not installed; fallback to simple progress.")
-        progress = "simple"
-        step = max(len(common) // 10, 1)
-
-    pvals: list[float] = []
-    for i, idx in enumerate(iterator):
-        v1 = g1.loc[idx].dropna().values
-        v2 = g2.loc[idx].dropna().values
-        if len(v1) < min_n or len(v2) < min_n:
-            pvals.append(np.nan)
-        else:
-            _, p = ttest_ind(v1, v2, equal_var=False, nan_policy="omit")
-            pvals.append(p)
-
-        if progress == "simple" and (i + 1) % step == 0:
-            print(f"  processed {i + 1}/{len(common)} CpGs…", end="\r")
-
-    bar_close()
-
-    if progress == "simple":
-        print()  # newline after last carriage return
-
-    out = pd.DataFrame({
-        f"{name1}_mean": mean1,
-        f"{name2}_mean": mean2,
-        "delta": delta,
-        "pvalue": pvals,
-    })
+    out = pd.DataFrame(
+        {
+            f"{name1}_mean": mean1,
+            f"{name2}_mean": mean2,
+            "delta": mean2 - mean1,
+            "pvalue": pvals,
+        },
+        index=common,
+    )
+
+    out["qvalue"] = _bh_qvalues(pvals)
 
-    p_array = np.asarray(pvals, dtype=float)
-    nan_mask = np.isnan(p_array)
-    p_filled = np.where(nan_mask, 1.0, p_array)
-    qvals = multipletests(p_filled, method="fdr_bh")[1]
+    return out
+
+
+def _bh_qvalues(pvals: np.ndarray) -> np.ndarray:
+    """Benjamini–Hochberg q‑values; NaN p‑values stay NaN."""
+    from statsmodels.stats.multitest import multipletests
+
+    nan_mask = np.isnan(pvals)
+    qvals = multipletests(np.where(nan_mask, 1.0, pvals), method="fdr_bh")[1]
     qvals[nan_mask] = np.nan
-    out["qvalue"] = qvals
+    return qvals
+
+def _rank_rows(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Row‑wise average ranks (1‑based, NaN for missing) and tie term Σ(t³ − t)."""
+    n_rows, n_cols = values.shape
+    order = np.argsort(values, axis=1, kind="stable")  # NaNs sort last
+    ordered = np.take_along_axis(values, order, axis=1)
+    valid = ~np.isnan(ordered)
+
+    new_run = np.ones_like(valid)
+    new_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run = np.cumsum(new_run.ravel()) - 1
+    size = np.bincount(run, weights=valid.ravel())
+    first = np.bincount(run, weights=np.tile(np.arange(1, n_cols + 1), n_rows) * valid.ravel())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = (first / size)[run].reshape(n_rows, n_cols)
+
+    ranks = np.empty_like(average)
+    np.put_along_axis(ranks, order, np.where(valid, average, np.nan), axis=1)
+    tie_size = size[run].reshape(n_rows, n_cols)
+    ties = np.where(valid, tie_size ** 2 - 1, 0.0).sum(axis=1)  # each of t tied values adds t² − 1
+    return ranks, ties
+
+
+def _anova_chunk(*groups: np.ndarray, min_n: int = 2, kruskal: bool = False) -> Tuple[np.ndarray, ...]:
+    """Row‑wise one‑way ANOVA (and Kruskal–Wallis) over k CpG × samples arrays.
+
+    Returns the k group means, F, its p‑value and, with *kruskal*, H and its
+    p‑value. Rows where a group has fewer than *min_n* values get NaN
+    statistics.
+    """
+    from scipy.stats import chi2, f as f_dist
+
+    k = len(groups)
+    moments = [_row_moments(g) for g in groups]
+    n = np.stack([m[0] for m in moments], axis=1).astype(float)
+    means = np.stack([m[1] for m in moments], axis=1)
+    var = np.stack([m[2] for m in moments], axis=1)
+    total = n.sum(axis=1)
+    enough = (n >= max(min_n, 2)).all(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        grand = np.nansum(n * means, axis=1) / total
+        between = np.nansum(n * (means - grand[:, None]) ** 2, axis=1)
+        within = np.nansum((n - 1) * var, axis=1)
+        f_stat = (between / (k - 1)) / (within / (total - k))
+        pvals = f_dist.sf(f_stat, k - 1, total - k)
+    f_stat[~enough] = np.nan
+    pvals[~enough] = np.nan
+    out = (*means.T, f_stat, pvals)
+
+    if kruskal:
+        ranks, ties = _rank_rows(np.concatenate(groups, axis=1))
+        edges = np.cumsum([0] + [g.shape[1] for g in groups])
+        rank_sums = np.stack([np.nansum(ranks[:, a:b], axis=1) for a, b in zip(edges[:-1], edges[1:])], axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            h_stat = 12.0 / (total * (total + 1)) * (rank_sums ** 2 / n).sum(axis=1) - 3 * (total + 1)
+            h_stat /= 1 - ties / (total ** 3 - total)
+            h_pvals = chi2.sf(h_stat, k - 1)
+        h_stat[~enough] = np.nan
+        h_pvals[~enough] = np.nan
+        out += (h_stat, h_pvals)
 
     return out
 
+
+def run_methylation_anova(
+    frames: Sequence[pd.DataFrame],
+    *,
+    names: Sequence[str] | None = None,
+    min_n: int = 2,
+    kruskal: bool = False,
+    memory_budget: int = _DEFAULT_CHUNK_MEMORY,
+    n_jobs: int | None = None,
+) -> pd.DataFrame:
+    """Per‑CpG one‑way ANOVA across any number of groups of β‑values.
+
+    The F statistic is computed from NaN‑aware row moments of whole row
+    chunks, in the same chunked pass as :func:`run_methylation_ttest`. With
+    *kruskal*, the Kruskal–Wallis H statistic (tie‑corrected) is computed
+    from row‑wise average ranks in the same pass.
+
+    Parameters
+    ----------
+    frames : sequence of DataFrame
+        CpG × samples matrices (index = CpG IDs), e.g. the tuple returned by
+        ``build_methylome_dataframes(groups=(...))``. At least two.
+    names : sequence of str, optional
+        Labels used to name the mean columns (default ``group1``, ``group2``…).
+    min_n : int
+        Minimum number of non‑missing values required in every group; CpGs
+        below it get NaN statistics.
+    kruskal : bool
+        Also run the Kruskal–Wallis test.
+    memory_budget : int
+        Approximate bytes of working memory per chunk of CpGs.
+    n_jobs : int, optional
+        If greater than 1, chunks are processed on a process pool.
+
+    Returns
+    -------
+    DataFrame
+        Columns: ``<name>_mean`` per group, ``delta`` (largest minus smallest
+        group mean), ``F, pvalue, qvalue`` and, with *kruskal*,
+        ``H, kw_pvalue, kw_qvalue``; CpG IDs as index.
+    """
+    frames = list(frames)
+    if len(frames) < 2:
+        raise ValueError("At least two groups are needed.")
+    names = list(names) if names is not None else [f"group{i + 1}" for i in range(len(frames))]
+    if len(names) != len(frames):
+        raise ValueError("names must have one label per group.")
+
+    common = frames[0].index
+    for frame in frames[1:]:
+        common = common.intersection(frame.index)
+
+    results = _map_row_chunks(
+        frames, common, partial(_anova_chunk, min_n=min_n, kruskal=kruskal),
+        memory_budget=memory_budget, n_jobs=n_jobs,
+    )
+    means = np.column_stack(results[:len(frames)])
+
+    out = pd.DataFrame({f"{name}_mean": column for name, column in zip(names, means.T)}, index=common)
+    with np.errstate(invalid="ignore"):
+        out["delta"] = np.nanmax(means, axis=1) - np.nanmin(means, axis=1) if len(common) else np.array([])
+    out["F"] = results[len(frames)]
+    out["pvalue"] = results[len(frames) + 1]
+    out["qvalue"] = _bh_qvalues(out["pvalue"].to_numpy())
+    if kruskal:
+        out["H"] = results[len(frames) + 2]
+        out["kw_pvalue"] = results[len(frames) + 3]
+        out["kw_qvalue"] = _bh_qvalues(out["kw_pvalue"].to_numpy())
+
+    return out
+
+
+_TIE_RTOL = 1e-9
+
+
+def _permutation_labels(n1: int, n2: int, n_permutations: int, seed=None) -> np.ndarray:
+    """``(n1 + n2, n_permutations + 1)`` 0/1 matrix of group‑1 memberships.
+
+    Column 0 is the observed labelling (the first *n1* samples); every other
+    column puts a random draw of *n1* samples in group 1.
+    """
+    rng = np.random.default_rng(seed)
+    n = n1 + n2
+    shuffled = rng.permuted(np.tile(np.arange(n), (n_permutations, 1)), axis=1)
+    labels = np.zeros((n, n_permutations + 1))
+    labels[:n1, 0] = 1.0
+    labels[shuffled[:, :n1], np.arange(1, n_permutations + 1)[:, None]] = 1.0
+    return labels
+
+
+def _welch_from_labels(
+    values: np.ndarray,
+    labels: np.ndarray,
+    min_n: int = 2,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Welch t and degrees of freedom of every labelling at once.
+
+    *values* is a CpG × samples chunk, *labels* a samples × labellings 0/1
+    matrix; group sums, counts and sums of squares come out of three matrix
+    products, so all labellings cost one pass over the chunk. Rows are
+    centred first to keep the sums of squares accurate. Labellings leaving
+    fewer than *min_n* non‑missing values in a group get NaN.
+    """
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centre = np.where(valid, values, 0.0).sum(axis=1, keepdims=True) / np.maximum(count, 1)
+    filled = np.where(valid, values - centre, 0.0)
+    squares = filled ** 2
+
+    n1 = valid.astype(float) @ labels
+    s1 = filled @ labels
+    q1 = squares @ labels
+    n2 = count - n1
+    s2 = filled.sum(axis=1, keepdims=True) - s1
+    q2 = squares.sum(axis=1, keepdims=True) - q1
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean1, mean2 = s1 / n1, s2 / n2
+        se1 = np.maximum(q1 - s1 * mean1, 0.0) / (n1 - 1) / n1
+        se2 = np.maximum(q2 - s2 * mean2, 0.0) / (n2 - 1) / n2
+        t = (mean1 - mean2) / np.sqrt(se1 + se2)
+        dof = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+
+    small = (n1 < max(min_n, 2)) | (n2 < max(min_n, 2))
+    t[small] = np.nan
+    dof[small] = np.nan
+    return t, dof
+
+
+class _PooledNull:
+    """Permutation FDR of observed statistics against a pooled null.
+
+    Null statistics are streamed in with :meth:`add`; for every observed value
+    only the number of null values reaching it is kept, so the null itself is
+    never stored.
+    """
+
+    def __init__(self, observed: np.ndarray):
+        self.sorted = np.sort(observed[np.isfinite(observed)])
+        self.targets = self.sorted * (1 - _TIE_RTOL)
+        self.null_ge = np.zeros(len(self.sorted), dtype=np.int64)
+
+    def add(self, null: np.ndarray) -> None:
+        null = np.ravel(null)
+        null = np.sort(null[~np.isnan(null)])  # sorted both ways, the lookup streams through memory
+        self.null_ge += len(null) - np.searchsorted(null, self.targets, side="left")
+
+    def qvalues(self, observed: np.ndarray, n_permutations: int) -> np.ndarray:
+        """``min over thresholds t <= s of (null hits >= t / B) / (observed >= t)``."""
+        qvals = np.full(len(observed), np.nan)
+        if not len(self.sorted):
+            return qvals
+        null_ge = self.null_ge
+        observed_ge = len(self.sorted) - np.searchsorted(self.sorted, self.sorted, side="left")
+        fdr = np.minimum.accumulate(np.minimum(null_ge / max(n_permutations, 1) / observed_ge, 1.0))
+        finite = np.isfinite(observed)
+        qvals[finite] = fdr[np.searchsorted(self.sorted, observed[finite], side="left")]
+        return qvals
+
+
+def _perm_row_step(n_samples: int, n_labels: int, memory_budget: int) -> int:
+    """Rows per chunk for ``n_labels`` labellings of an ``n_samples`` matrix."""
+    return max(1, int(memory_budget // (8 * (4 * n_samples + 10 * n_labels))))
+
+
+def run_permutation_ttest(
+    df1: pd.DataFrame,
+    df2: pd.DataFrame,
+    *,
+    n_permutations: int = 1000,
+    seed=None,
+    min_n: int = 2,
+    perm_chunk: int = 256,
+    memory_budget: int = _DEFAULT_CHUNK_MEMORY,
+) -> pd.DataFrame:
+    """Per‑CpG Welch t‑test with permutation p‑values and a permutation FDR.
+
+    Sample labels are shuffled across the two groups; the Welch t of every
+    CpG under *perm_chunk* permutations is obtained from one set of matrix
+    products per chunk of CpGs (see :func:`run_methylation_ttest` for the
+    observed test). All CpGs share the same permutations.
+
+    Parameters
+    ----------
+    df1, df2 : DataFrame
+        CpG × samples matrices (index = CpG IDs).
+    n_permutations : int
+        Number of label permutations.
+    seed : int or SeedSequence, optional
+        Seed of the permutations; the same seed gives the same result.
+    min_n : int
+        Minimum number of non‑missing values required in each group.
+    perm_chunk : int
+        Permutations evaluated together.
+    memory_budget : int
+        Approximate bytes of working memory per chunk of CpGs.
+
+    Returns
+    -------
+    DataFrame
+        Columns: ``t, perm_pvalue, perm_qvalue`` with CpG IDs as index.
+        *perm_pvalue* is ``(1 + #{|t*| >= |t|}) / (1 + #permutations)`` for
+        the CpG's own null; *perm_qvalue* compares the number of CpGs called
+        at each threshold with the average number called in the permuted
+        data (pooled over all CpGs).
+    """
+    common = df1.index.intersection(df2.index)
+    blocks = [frame.to_numpy() for frame in (df1, df2)]
+    positions = [frame.index.get_indexer(common) for frame in (df1, df2)]
+    labels = _permutation_labels(df1.shape[1], df2.shape[1], n_permutations, seed)
+
+    step = _perm_row_step(labels.shape[0], min(perm_chunk, n_permutations) + 1, memory_budget)
+
+    def load(lo):
+        return np.hstack([_take_rows(block, pos[lo:lo + step]) for block, pos in zip(blocks, positions)])
+
+    t_obs = np.empty(len(common))
+    for lo in range(0, len(common), step):
+        t_obs[lo:lo + step] = _welch_from_labels(load(lo), labels[:, :1], min_n)[0][:, 0]
+    observed = np.abs(t_obs)
+
+    pooled = _PooledNull(observed)
+    reached = np.zeros(len(common), dtype=np.int64)
+    tested = np.zeros(len(common), dtype=np.int64)
+    for lo in range(0, len(common), step):
+        values = load(lo)
+        target = observed[lo:lo + step, None] * (1 - _TIE_RTOL)
+        for first in range(1, n_permutations + 1, perm_chunk):
+            null = np.abs(_welch_from_labels(values, labels[:, first:first + perm_chunk], min_n)[0])
+            with np.errstate(invalid="ignore"):
+                reached[lo:lo + step] += (null >= target).sum(axis=1)
+            tested[lo:lo + step] += (~np.isnan(null)).sum(axis=1)
+            pooled.add(null)
+
+    pvals = (1.0 + reached) / (1.0 + tested)
+    pvals[np.isnan(observed)] = np.nan
+
+    return pd.DataFrame(
+        {
+            "t": t_obs,
+            "perm_pvalue": pvals,
+            "perm_qvalue": pooled.qvalues(observed, n_permutations),
+        },
+        index=common,
+    )
+
+
+def _log10_welch_pvalues(values: np.ndarray, labels: np.ndarray, min_n: int) -> np.ndarray:
+    """``-log10`` two‑sided Welch p‑values of every labelling of a chunk."""
+    from scipy.stats import t as t_dist
+
+    t, dof = _welch_from_labels(values, labels, min_n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return -np.log10(2.0 * t_dist.sf(np.abs(t), dof))
+
+
+def run_permutation_peaks(
+    df1: pd.DataFrame,
+    df2: pd.DataFrame,
+    annotation: pd.DataFrame,
+    threshold: float,
+    *,
+    method: str = "savgol",
+    n: int = 11,
+    order: int = 2,
+    snr_window: int = 3,
+    max_gap: int = 0,
+    min_cpgs: int = 1,
+    n_permutations: int = 100,
+    seed=None,
+    min_n: int = 2,
+    perm_chunk: int = 16,
+    memory_budget: int = _DEFAULT_CHUNK_MEMORY,
+) -> pd.DataFrame:
+    """Smoothed ``Signal_Noise_Ratio`` peaks with permutation p‑values and FDR.
+
+    The observed track is built as in the pipeline: per‑CpG ``-log10`` Welch
+    p‑values, smoothed by chromosome (*method*, *n*, *order*), then turned
+    into a signal to noise ratio over *snr_window* CpGs and called with
+    :func:`Peaks.call_peaks`. Each permutation of the sample labels rebuilds
+    the whole track; *perm_chunk* permuted tracks are tested, smoothed and
+    scanned together as one CpG × permutations block.
+
+    Parameters
+    ----------
+    df1, df2 : DataFrame
+        CpG × samples matrices (index = CpG IDs).
+    annotation : DataFrame
+        ``Predictor``, ``Chromosome``, ``Position`` (and optionally
+        ``Gene Name``) of the CpGs to scan, e.g. the merged frame.
+    threshold : float
+        Peak calling threshold on ``Signal_Noise_Ratio``.
+    method, n, order : str, int, int
+        Smoother, ``"savgol"`` or ``"mean"``, its window and polynomial order.
+    snr_window : int
+        Window of the rolling signal.
+    max_gap, min_cpgs : int
+        Peak calling options, see :func:`Peaks.call_peaks`.
+    n_permutations : int
+        Number of label permutations.
+    seed : int or SeedSequence, optional
+        Seed of the permutations.
+    min_n : int
+        Minimum number of non‑missing values required in each group.
+    perm_chunk : int
+        Permuted tracks held in memory together (each is ``len(annotation)``
+        float64 values, plus a few temporaries).
+    memory_budget : int
+        Approximate bytes of working memory per chunk of CpGs for the tests.
+
+    Returns
+    -------
+    DataFrame
+        The observed peaks (columns of :func:`Peaks.call_peaks`) with
+        ``perm_pvalue``, the share of permutations whose highest peak reaches
+        the peak's ``max``, and ``perm_qvalue``, the average number of
+        permuted peaks at least as high divided by the number of observed
+        ones.
+    """
+    common = df1.index.intersection(df2.index)
+    annotation = annotation[annotation["Predictor"].isin(common)]
+    annotation, bounds = genomic_order(annotation)
+    positions = annotation["Position"].to_numpy()
+    values = np.hstack([
+        _take_rows(frame.to_numpy(), frame.index.get_indexer(annotation["Predictor"])) for frame in (df1, df2)
+    ])
+    labels = _permutation_labels(df1.shape[1], df2.shape[1], n_permutations, seed)
+
+    def snr_tracks(columns):
+        step = _perm_row_step(values.shape[1], columns.shape[1], memory_budget)
+        stat = np.empty((len(values), columns.shape[1]))
+        for lo in range(0, len(values), step):
+            stat[lo:lo + step] = _log10_welch_pvalues(values[lo:lo + step], columns, min_n)
+        smoothed = smooth_matrix(stat, method, n, order, bounds=bounds)
+        if method == "savgol":
+            np.maximum(smoothed, 0, out=smoothed)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return rolling_signal(smoothed, bounds, (snr_window,))[..., 0] / np.nanmean(smoothed, axis=0)
+
+    observed_snr = snr_tracks(labels[:, :1])[:, 0]
+    peaks = call_peaks(
+        annotation.assign(Signal_Noise_Ratio=observed_snr), threshold, max_gap=max_gap, min_cpgs=min_cpgs
+    )
+    observed = peaks["max"].to_numpy(dtype=float)
+
+    pooled = _PooledNull(observed)
+    highest = np.full(n_permutations, -np.inf)
+    for first in range(1, n_permutations + 1, perm_chunk):
+        tracks = snr_tracks(labels[:, first:first + perm_chunk])
+        for k in range(tracks.shape[1]):
+            maxima = peak_maxima(tracks[:, k], bounds, positions, threshold, max_gap=max_gap, min_cpgs=min_cpgs)
+            pooled.add(maxima)
+            if len(maxima):
+                highest[first - 1 + k] = maxima.max()
+
+    reached = (highest[None, :] >= observed[:, None] * (1 - _TIE_RTOL)).sum(axis=1)
+    peaks["perm_pvalue"] = (1.0 + reached) / (1.0 + n_permutations)
+    peaks["perm_qvalue"] = pooled.qvalues(observed, n_permutations)
+    return peaks
+
+
+_JZS_LOG_G = np.linspace(-10.0, 28.0, 65)
+_JZS_CHUNK = 4096
+
+
+def _student_t(g1: np.ndarray, g2: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Row‑wise pooled‑variance t statistic and the per‑row group sizes."""
+    n1, mean1, var1 = _row_moments(g1)
+    n2, mean2, var2 = _row_moments(g2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pooled = ((n1 - 1) * var1 + (n2 - 1) * var2) / (n1 + n2 - 2)
+        t = (mean1 - mean2) / np.sqrt(pooled * (1.0 / n1 + 1.0 / n2))
+
+    return t, n1, n2
+
+
+def _jzs_bf10(t: np.ndarray, n1: np.ndarray, n2: np.ndarray, r: float = 0.707) -> np.ndarray:
+    """JZS Bayes factors for two‑sample t statistics (Rouder et al., 2009).
+
+    The integral over the Cauchy prior scale *g* is evaluated for all rows at
+    once with a trapezoidal rule on ``log g``, in log space to avoid overflow.
+    Matches ``pingouin.bayesfactor_ttest`` for the two‑sided alternative.
+    """
+    t = np.asarray(t, dtype=float)
+    n1 = np.asarray(n1, dtype=float)
+    n2 = np.asarray(n2, dtype=float)
+    bf10 = np.full(t.shape, np.nan)
+
+    ok = np.isfinite(t) & (n1 >= 2) & (n2 >= 2)
+    t, n1, n2 = t[ok], n1[ok], n2[ok]
+    out = np.empty(t.shape)
+
+    log_g = _JZS_LOG_G
+    g = np.exp(log_g)
+    step = log_g[1] - log_g[0]
+    # Prior part of the integrand, including the Jacobian dg = g d(log g).
+    log_prior = -0.5 * np.log(2 * np.pi) - 0.5 * log_g - 1.0 / (2 * g)
+
+    for lo in range(0, len(t), _JZS_CHUNK):
+        sl = slice(lo, lo + _JZS_CHUNK)
+        tt = t[sl, None] ** 2
+        dof = (n1[sl] + n2[sl] - 2)[:, None]
+        neff = (n1[sl] * n2[sl] / (n1[sl] + n2[sl]))[:, None]
+
+        scale = 1 + neff * g * r ** 2
+        log_f = (
+            -0.5 * np.log(scale)
+            - (dof + 1) / 2 * np.log1p(tt / (scale * dof))
+            + log_prior
+        )
+        peak = log_f.max(axis=1, keepdims=True)
+        weights = np.exp(log_f - peak)
+        log_int = np.log(step * (weights.sum(axis=1) - 0.5 * (weights[:, 0] + weights[:, -1]))) + peak[:, 0]
+
+        with np.errstate(over="ignore"):
+            out[sl] = np.exp(log_int + (dof[:, 0] + 1) / 2 * np.log1p(tt[:, 0] / dof[:, 0]))
+
+    bf10[ok] = out
+    return bf10
+
+
+def _bayes_chunk(g1: np.ndarray, g2: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Group means and JZS BF10 for one chunk of CpGs."""
+    t, n1, n2 = _student_t(g1, g2)
+    return _row_moments(g1)[1], _row_moments(g2)[1], _jzs_bf10(t, n1, n2)
+
+
 def _bayes_ttest(group1: np.ndarray, group2: np.ndarray) -> float:
     try:
         import pingouin as pg  # local import to keep dependency optional
     except ModuleNotFoundError as err:
         raise ImportError(
-            "run_bayesian_methylation_test requires the 'pingouin' package.\n"
+            "The pingouin cross-check requires the 'pingouin' package.\n"
             "Install it with:  pip install pingouin"
         ) from err
 
     res = pg.ttest(group1, group2, correction=False)
-    return float(res.loc["T-test", "BF10"])
+    return float(res["BF10"].iloc[0])
 
 
 def run_bayesian_methylation_test(
@@ -162,9 +836,17 @@ def run_bayesian_methylation_test(
     name1: str = "Grp1",
     name2: str = "Grp2",
     progress: bool | str = False,
+    crosscheck: int = 0,
+    seed: int | None = None,
+    memory_budget: int = _DEFAULT_CHUNK_MEMORY,
+    n_jobs: int | None = None,
 ) -> pd.DataFrame:
     """Compute per‑CpG Bayes‑factor between two groups of β‑values.
 
+    Student t statistics are computed on whole row chunks and converted to
+    JZS Bayes factors (Cauchy prior, r = 0.707) by vectorised quadrature.
+    Memory‑mapped inputs are read chunk by chunk.
+
     Parameters
     ----------
     df1, df2 : DataFrame
@@ -173,8 +855,17 @@ def run_bayesian_methylation_test(
     name1, name2 : str
         Labels used to name the output columns.
     progress : bool or str
-        If truthy, wrap the loop with `tqdm` progress bar. If a string, that
-        string is used as the *desc* argument for tqdm.
+        If truthy, wrap the row chunks with a `tqdm` progress bar. If a
+        string, that string is used as the *desc* argument for tqdm.
+    crosscheck : int
+        Number of randomly chosen CpGs recomputed with ``pingouin.ttest`` and
+        compared to the native values (requires pingouin). ``0`` disables it.
+    seed : int, optional
+        Seed for the choice of cross‑checked CpGs.
+    memory_budget : int
+        Approximate bytes of working memory per chunk of CpGs.
+    n_jobs : int, optional
+        If greater than 1, chunks are processed on a process pool.
 
     Returns
     -------
@@ -189,29 +880,28 @@ def run_bayesian_methylation_test(
     if common.empty:
         raise ValueError("df1 and df2 share no CpG IDs.")
 
-    g1 = df1.loc[common].to_numpy(dtype=float)
-    g2 = df2.loc[common].to_numpy(dtype=float)
-
-    means1 = np.nanmean(g1, axis=1)
-    means2 = np.nanmean(g2, axis=1)
+    means1, means2, bf10 = _map_row_chunks(
+        (df1, df2), common, _bayes_chunk,
+        memory_budget=memory_budget, n_jobs=n_jobs,
+        progress="Compute BF10" if progress is True else progress,
+    )
     delta  = means2 - means1
 
-    iterator: Iterable[int]
-    if progress:
-        try:
-            from tqdm import tqdm
-
-            desc = progress if isinstance(progress, str) else "Compute BF10"
-            iterator = tqdm(range(len(common)), desc=desc)
-        except ModuleNotFoundError:
-            print("[run_bayesian_methylation_test] tqdm not installed – running without progress bar")
-            iterator = range(len(common))
-    else:
-        iterator = range(len(common))
-
-    bf10 = np.empty(len(common), dtype=float)
-    for i in iterator:
-        bf10[i] = _bayes_ttest(g1[i, :], g2[i, :])
+    if crosscheck:
+        rng = np.random.default_rng(seed)
+        candidates = np.flatnonzero(np.isfinite(bf10))
+        picked = np.sort(rng.choice(candidates, size=min(crosscheck, len(candidates)), replace=False))
+        g1 = _take_rows(df1.to_numpy(), df1.index.get_indexer(common[picked]))
+        g2 = _take_rows(df2.to_numpy(), df2.index.get_indexer(common[picked]))
+        reference = np.array([
+            _bayes_ttest(row1[~np.isnan(row1)], row2[~np.isnan(row2)]) for row1, row2 in zip(g1, g2)
+        ])
+        # pingouin reports BF10 rounded to three significant digits.
+        if not np.allclose(bf10[picked], reference, rtol=1e-2):
+            print(
+                "[run_bayesian_methylation_test] warning: native BF10 differs from "
+                "pingouin on some cross-checked CpGs"
+            )
 
     out = pd.DataFrame(
         {
@@ -223,3 +913,6 @@ def run_bayesian_methylation_test(
         index=common,
     )
     return out
+
+
+instrument_module(__name__)
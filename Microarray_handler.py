@@ -1,9 +1,18 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from typing import Tuple, Dict, List
 
+import numpy as np
 import pandas as pd
 import pathlib
 
+from Instrumentation import instrument_module
+
 
 def read_sdrf(path: str, *,comment_prefix: str = "!",sep: str = "\t",) -> pd.DataFrame:
     path = pathlib.Path(path)
@@ -17,6 +26,109 @@ def _clean_source_name(name: str) -> str:
 
     return name.strip().split()[0]
 
+def _read_sample_table(file_path: pathlib.Path, id_col: str, value_col: str) -> Tuple[np.ndarray, np.ndarray]:
+    table = pd.read_csv(
+        file_path,
+        sep="\t",
+        usecols=[id_col, value_col],
+        dtype={id_col: str, value_col: np.float32},
+    )
+    return table[id_col].to_numpy(dtype=object), table[value_col].to_numpy(dtype=np.float32)
+
+def _assemble_group(tables: List[Tuple[str, np.ndarray, np.ndarray]], id_col: str) -> pd.DataFrame:
+    """Place the sample columns of one group into a preallocated CpG×samples block."""
+    index = pd.Index(pd.unique(np.concatenate([ids for _, ids, _ in tables])), name=id_col).sort_values()
+    block = np.full((len(index), len(tables)), np.nan, dtype=np.float32)
+
+    previous_ids, positions = None, None
+    for j, (_, ids, values) in enumerate(tables):
+        # GEO sample tables usually list the probes in the same order.
+        if previous_ids is None or not np.array_equal(ids, previous_ids):
+            positions = index.get_indexer(ids)
+            previous_ids = ids
+        block[positions, j] = values
+
+    return pd.DataFrame(block, index=index, columns=[sample_id for sample_id, _, _ in tables])
+
+def _cache_key(sdrf_path: str, sample_dir: pathlib.Path, file_suffix: str, options: dict) -> str:
+    """Hash of the inputs that determine the parsed matrices.
+
+    Includes the SDRF and every ``*<file_suffix>`` sample table by path, size
+    and modification time, so editing or adding a file invalidates the entry.
+    """
+    sdrf = pathlib.Path(sdrf_path).resolve()
+    stat = sdrf.stat()
+    samples = sorted(
+        (path.name, path.stat().st_size, path.stat().st_mtime_ns)
+        for path in sample_dir.glob(f"*{file_suffix}")
+    )
+    payload = {
+        "sdrf": [str(sdrf), stat.st_size, stat.st_mtime_ns],
+        "sample_dir": str(sample_dir.resolve()),
+        "samples": samples,
+        "options": options,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def _cache_load(cache_dir: pathlib.Path, key: str, id_col: str) -> Tuple[pd.DataFrame | None, ...] | None:
+    entry = cache_dir / key
+    meta_path = entry / "meta.json"
+    if not meta_path.exists():
+        return None
+
+    meta = json.loads(meta_path.read_text())
+    frames = []
+    for i, present in enumerate(meta["groups"]):
+        if not present:
+            frames.append(None)
+            continue
+        values = np.load(entry / f"group{i}_values.npy", mmap_mode="c")
+        index = pd.Index(np.load(entry / f"group{i}_index.npy").astype(object), name=id_col)
+        columns = np.load(entry / f"group{i}_columns.npy").astype(object)
+        frames.append(pd.DataFrame(values, index=index, columns=columns, copy=False))
+
+    os.utime(meta_path)  # mark as recently used for eviction
+    return tuple(frames)
+
+def _cache_store(cache_dir: pathlib.Path, key: str, frames: Tuple[pd.DataFrame | None, ...], max_bytes: int) -> None:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = cache_dir / key
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix=f".{key}-", dir=cache_dir))
+
+    for i, frame in enumerate(frames):
+        if frame is None:
+            continue
+        np.save(tmp / f"group{i}_values.npy", np.ascontiguousarray(frame.to_numpy(dtype=np.float32)))
+        np.save(tmp / f"group{i}_index.npy", frame.index.to_numpy(dtype=str))
+        np.save(tmp / f"group{i}_columns.npy", frame.columns.to_numpy(dtype=str))
+    (tmp / "meta.json").write_text(json.dumps({"groups": [frame is not None for frame in frames]}))
+
+    try:
+        tmp.rename(entry)
+    except OSError:  # another run stored the same entry meanwhile
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    _cache_evict(cache_dir, max_bytes, keep=key)
+
+def _cache_evict(cache_dir: pathlib.Path, max_bytes: int, keep: str) -> None:
+    """Remove least recently used entries until the cache fits in *max_bytes*."""
+    entries = []
+    for entry in cache_dir.iterdir():
+        meta_path = entry / "meta.json"
+        if not entry.is_dir() or entry.name.startswith(".") or not meta_path.exists():
+            continue
+        size = sum(f.stat().st_size for f in entry.iterdir())
+        entries.append((meta_path.stat().st_mtime, size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry.name == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
 def build_methylome_dataframes(
     sdrf_path: str,
     sample_dir: str,
@@ -25,15 +137,41 @@ def build_methylome_dataframes(
     source_col: str = "Source Name",
     value_col: str = "VALUE",
     id_col: str = "Reporter Identifier",
-    groups: Tuple[str, str] = ("Newborns", "Nonagenarians"),
+    groups: Tuple[str, ...] = ("Newborns", "Nonagenarians"),
     file_suffix: str = "_sample_table.txt",
-) -> Tuple[pd.DataFrame | None, pd.DataFrame | None]:
-    """Return one CpG×samples matrix per group.
+    max_workers: int | None = None,
+    cache_dir: str | None = None,
+    cache_max_bytes: int = 4 * 1024 ** 3,
+) -> Tuple[pd.DataFrame | None, ...]:
+    """Return one CpG×samples matrix per group, in the order of *groups*.
+
+    Any number of groups can be requested, e.g. for ``Maths.run_methylation_anova``.
 
     The *Source Name* column is cleaned automatically (``GSM765899 1`` →
-    ``GSM765899``) so the corresponding sample table is located.
+    ``GSM765899``) so the corresponding sample table is located. Only the
+    *id_col* and *value_col* columns are read, on a pool of *max_workers*
+    threads, and each group is filled into a float32 block indexed by the
+    union of its CpG IDs. Missing sample files are reported once at the end.
+
+    With *cache_dir*, the matrices are stored there as ``.npy`` files keyed by
+    the SDRF, the column arguments and the size and mtime of every sample
+    table; a later call with unchanged inputs memory-maps them instead of
+    parsing the text files. Least recently used entries are evicted once the
+    cache exceeds *cache_max_bytes*.
     """
 
+    sample_dir = pathlib.Path(sample_dir)
+    if cache_dir is not None:
+        cache_dir = pathlib.Path(cache_dir)
+        options = {
+            "group_col": group_col, "source_col": source_col, "value_col": value_col,
+            "id_col": id_col, "groups": list(groups), "file_suffix": file_suffix,
+        }
+        key = _cache_key(sdrf_path, sample_dir, file_suffix, options)
+        cached = _cache_load(cache_dir, key, id_col)
+        if cached is not None:
+            return cached
+
     sdrf = read_sdrf(sdrf_path)
 
     mapping = (
@@ -46,28 +184,30 @@ def build_methylome_dataframes(
         mapping.groupby(group_col)["clean_id"].apply(list).to_dict()
     )
 
-    dfs: Dict[str, pd.DataFrame] = {}
-    sample_dir = pathlib.Path(sample_dir)
+    wanted = {
+        group: [(sample_id, sample_dir / f"{sample_id}{file_suffix}") for sample_id in group_to_samples.get(group, [])]
+        for group in groups
+    }
+
+    missing = sorted({str(path) for files in wanted.values() for _, path in files if not path.exists()})
+    present = sorted({path for files in wanted.values() for _, path in files if str(path) not in missing})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        loaded = dict(zip(present, pool.map(lambda path: _read_sample_table(path, id_col, value_col), present)))
 
-    for group in groups:
-        samples = group_to_samples.get(group, [])
-        tmp: pd.DataFrame | None = None
-        for sample_id in samples:
-            file_path = sample_dir / f"{sample_id}{file_suffix}"
-            if not file_path.exists():
-                print(f"[build_methylome_dataframes] warning: file not found : {file_path}")
-                continue
+    if missing:
+        shown = ", ".join(missing[:5]) + (", …" if len(missing) > 5 else "")
+        print(f"[build_methylome_dataframes] warning: {len(missing)} sample file(s) not found: {shown}")
 
-            table = pd.read_csv(file_path, sep="\t", dtype={id_col: str})
+    dfs: Dict[str, pd.DataFrame | None] = {}
+    for group, files in wanted.items():
+        tables = [(sample_id, *loaded[path]) for sample_id, path in files if path in loaded]
+        dfs[group] = _assemble_group(tables, id_col) if tables else None
 
-            sample_series = (
-                table[[id_col, value_col]]
-                .rename(columns={value_col: sample_id})
-                .set_index(id_col)
-                .astype(float)
-            )
-            tmp = sample_series if tmp is None else tmp.join(sample_series, how="outer")
+    result = tuple(dfs.get(g) for g in groups)
+    if cache_dir is not None:
+        _cache_store(cache_dir, key, result, cache_max_bytes)
+    return result
 
-        dfs[group] = tmp.sort_index() if tmp is not None else None
 
-    return tuple(dfs.get(g) for g in groups)
\ No newline at end of file
+instrument_module(__name__)
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from Instrumentation import instrument_module
+from Smoothing import genomic_order
+
+
+def _range_reduce(ufunc, values, first, last):
+    """Apply *ufunc* over each inclusive row range ``first[i]..last[i]``."""
+    padded = np.append(values, values[:1])
+    edges = np.column_stack((first, last + 1)).ravel()
+    return ufunc.reduceat(padded, edges)[::2]
+
+
+def _peak_ranges(above, bounds, positions, max_gap, min_cpgs):
+    """First and last row of each peak of the boolean track *above*.
+
+    Runs never cross a segment boundary of *bounds*; runs of one segment closer
+    than *max_gap* bp are merged and peaks under *min_cpgs* rows dropped.
+    """
+    boundary = np.zeros(len(above) + 1, dtype=bool)
+    boundary[bounds] = True
+
+    previous = np.concatenate(([False], above[:-1])) & ~boundary[:-1]
+    following = np.concatenate((above[1:], [False])) & ~boundary[1:]
+    run_first = np.flatnonzero(above & ~previous)
+    run_last = np.flatnonzero(above & ~following)
+
+    segment = np.searchsorted(bounds, run_first, side='right') - 1
+    merge = (segment[1:] == segment[:-1]) & (positions[run_first[1:]] - positions[run_last[:-1]] <= max_gap)
+    first = run_first[np.concatenate(([True], ~merge))[:len(run_first)]]
+    last = run_last[np.concatenate((~merge, [True]))[-len(run_last):]] if len(run_last) else run_last
+
+    keep = last - first + 1 >= min_cpgs
+    return first[keep], last[keep]
+
+
+def call_peaks(df, threshold, column='Signal_Noise_Ratio', *, max_gap=0, min_cpgs=1):
+    """Call peaks where *column* exceeds *threshold*, chromosome by chromosome.
+
+    Runs of consecutive CpGs above the threshold are found by run-length
+    encoding; runs on the same chromosome separated by at most *max_gap* bp are
+    merged into one peak. Every step is a vectorised pass over the rows, so the
+    cost is linear in the number of CpGs.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Frame with ``Chromosome``, ``Position`` and *column* (e.g. the output
+        of ``signal_noise_pangenomic`` or a ``smooth_result`` column). Sorted
+        by chromosome and position if it is not already.
+    threshold : float
+        Values strictly above it belong to a peak.
+    column : str
+        Signal used for calling.
+    max_gap : int
+        Largest distance in bp between two runs that are merged.
+    min_cpgs : int
+        Minimum number of CpGs spanned by a reported peak.
+
+    Returns
+    -------
+    DataFrame
+        One row per peak: ``Chromosome, start, end, n_cpg, max, area, genes``.
+        *area* sums the excess over the threshold, *genes* lists the distinct
+        ``Gene Name`` values inside the peak.
+    """
+    df, bounds = genomic_order(df)
+    values = df[column].to_numpy(dtype=float)
+    positions = df['Position'].to_numpy()
+
+    above = values > threshold
+    first, last = _peak_ranges(above, bounds, positions, max_gap, min_cpgs)
+
+    excess = np.where(above, values - threshold, 0.0)
+    peaks = pd.DataFrame({
+        'Chromosome': df['Chromosome'].to_numpy()[first],
+        'start': positions[first],
+        'end': positions[last],
+        'n_cpg': last - first + 1,
+        'max': _range_reduce(np.fmax, values, first, last) if len(first) else np.array([]),
+        'area': _range_reduce(np.add, excess, first, last) if len(first) else np.array([]),
+    })
+
+    if 'Gene Name' in df.columns:
+        peaks['genes'] = _peak_genes(df['Gene Name'], first, last)
+
+    return peaks
+
+
+def peak_maxima(values, bounds, positions, threshold, *, max_gap=0, min_cpgs=1):
+    """Maxima of the peaks :func:`call_peaks` would report on a bare array.
+
+    *values* and *positions* are in genomic order with segments
+    ``bounds[i]:bounds[i + 1]`` (one per chromosome). Used for the null
+    distributions of peak heights, where building a table per track would
+    dominate the cost.
+    """
+    values = np.asarray(values, dtype=float)
+    first, last = _peak_ranges(values > threshold, bounds, positions, max_gap, min_cpgs)
+    return _range_reduce(np.fmax, values, first, last) if len(first) else np.array([])
+
+
+def _peak_genes(genes, first, last):
+    """Comma-separated distinct gene names of each row range."""
+    membership = np.zeros(len(genes) + 1, dtype=np.int64)
+    np.add.at(membership, first, 1)
+    np.add.at(membership, last + 1, -1)
+    inside = np.flatnonzero(np.cumsum(membership[:-1]) > 0)
+
+    peak_of_row = np.searchsorted(first, inside, side='right') - 1
+    rows = pd.DataFrame({'peak': peak_of_row, 'gene': genes.to_numpy()[inside]}).dropna().drop_duplicates()
+
+    labels = np.full(len(first), '', dtype=object)
+    if len(rows):
+        peak = rows['peak'].to_numpy()
+        cuts = np.flatnonzero(np.diff(peak)) + 1
+        names = rows['gene'].astype(str).to_numpy()
+        labels[peak[np.concatenate(([0], cuts))]] = [', '.join(chunk) for chunk in np.split(names, cuts)]
+    return labels
+
+
+instrument_module(__name__)
@@ -0,0 +1,333 @@
+"""Resumable end-to-end analysis, partitioned by chromosome.
+
+The stages of the usual notebook chain run as a small DAG::
+
+    ingest ─ split ─┬─ test ─ merge ─ smooth ─ signal  (chromosome 1) ─┬─ results ─ plots
+                    ├─ ...                                              │
+                    └─ test ─ merge ─ smooth ─ signal  (chromosome Y) ─┘
+
+*ingest* parses the sample tables with ``build_methylome_dataframes`` (its
+``.npy`` cache lives in the output directory). *split* annotates the CpGs with
+the manifest and writes one input partition per chromosome. The per-chromosome
+chains run on a process pool; *results* gathers them, computes the
+genome-wide q-values and signal to noise ratio, and *plots* draws the
+Manhattan plot headless.
+
+Every stage output is checkpointed under the output directory together with a
+key hashing its parameters and the keys (or, for the partitions, the content)
+of its inputs. A re-run, after a crash or with other parameters, only
+recomputes the stages and chromosomes whose key changed.
+
+Command line::
+
+    python Pipeline.py --sdrf E-GEOD-30870.sdrf.txt --samples samples/ \\
+        --manifest annotation.tsv --out run/ --method savgol --n 11 --order 2
+"""
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from Instrumentation import instrument_module
+from Maths import _bh_qvalues, run_methylation_ttest
+from Microarray_handler import build_methylome_dataframes
+from Preprocessing import AnnotationManifest, merge, normalize_methylome
+from SNR_tools import rolling_signal
+from Smoothing import mean_smoothing, savgol_smoothing
+from Utils import chromosome_sort
+
+DEFAULT_PARAMS = {
+    "groups": ["Newborns", "Nonagenarians"],
+    "min_n": 2,
+    "method": "savgol",
+    "n": 11,
+    "order": 2,
+    "snr_window": 3,
+    "plots": True,
+}
+
+def _key(*parts) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class _Checkpoints:
+    """Stage outputs of one directory and the keys they were computed with."""
+
+    def __init__(self, directory: pathlib.Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._state_path = directory / "state.json"
+        self.state = json.loads(self._state_path.read_text()) if self._state_path.exists() else {}
+
+    def path(self, stage: str) -> pathlib.Path:
+        return self.directory / f"{stage}.pkl"
+
+    def is_current(self, stage: str, key: str) -> bool:
+        return self.state.get(stage) == key and self.path(stage).exists()
+
+    def load(self, stage: str):
+        return pd.read_pickle(self.path(stage))
+
+    def store(self, stage: str, key: str, value) -> None:
+        tmp = self.path(stage).with_suffix(".tmp")
+        pd.to_pickle(value, tmp)
+        os.replace(tmp, self.path(stage))
+        self.state[stage] = key
+        tmp_state = self._state_path.with_suffix(".tmp")
+        tmp_state.write_text(json.dumps(self.state, indent=1))
+        os.replace(tmp_state, self._state_path)
+
+
+def _partition_chain(directory: str, params: dict):
+    """Run the per-chromosome stages of one partition; return their keys and what was recomputed."""
+    checkpoints = _Checkpoints(pathlib.Path(directory))
+    keys = {
+        "test": _key(checkpoints.state["input"], "test", params["groups"], params["min_n"]),
+    }
+    keys["merge"] = _key(keys["test"], "merge")
+    keys["smooth"] = _key(keys["merge"], "smooth", params["method"], params["n"], params["order"])
+    keys["signal"] = _key(keys["smooth"], "signal", params["snr_window"])
+
+    recomputed = []
+    cache = {}
+
+    def get(stage):
+        if stage not in cache:
+            cache[stage] = checkpoints.load(stage)
+        return cache[stage]
+
+    if not checkpoints.is_current("test", keys["test"]):
+        part = get("input")
+        df1 = pd.DataFrame(part["g1"], index=part["ids"], columns=part["columns1"])
+        df2 = pd.DataFrame(part["g2"], index=part["ids"], columns=part["columns2"])
+        name1, name2 = params["groups"]
+        stats = run_methylation_ttest(df1, df2, name1=name1, name2=name2, min_n=params["min_n"], progress=False)
+        cache["test"] = stats.drop(columns="qvalue").rename_axis("Predictor").reset_index()
+        checkpoints.store("test", keys["test"], cache["test"])
+        recomputed.append("test")
+
+    if not checkpoints.is_current("merge", keys["merge"]):
+        merged = merge(get("test"), AnnotationManifest(get("input")["annotation"]))
+        merged["log10_pvalue"] = -np.log10(merged["pvalue"])
+        cache["merge"] = merged.sort_values("Position", kind="stable", ignore_index=True)
+        checkpoints.store("merge", keys["merge"], cache["merge"])
+        recomputed.append("merge")
+
+    if not checkpoints.is_current("smooth", keys["smooth"]):
+        frame = get("merge").copy()
+        if params["method"] == "savgol":
+            savgol_smoothing(frame, "log10_pvalue", params["n"], params["order"])
+        else:
+            mean_smoothing(frame, "log10_pvalue", params["n"])
+        cache["smooth"] = frame
+        checkpoints.store("smooth", keys["smooth"], frame)
+        recomputed.append("smooth")
+
+    if not checkpoints.is_current("signal", keys["signal"]):
+        frame = get("smooth").copy()
+        values = frame["smooth_result"].to_numpy(dtype=float)
+        frame["Signal"] = rolling_signal(values, [0, len(values)], (params["snr_window"],))[:, 0]
+        checkpoints.store("signal", keys["signal"], frame)
+        recomputed.append("signal")
+
+    return keys["signal"], recomputed
+
+
+class Pipeline:
+    """Checkpointed methylome analysis in *out_dir*.
+
+    *params* override :data:`DEFAULT_PARAMS`; *n_jobs* chromosome chains run
+    in parallel (``1`` runs them in this process).
+
+    Example:
+        >>> pipeline = Pipeline("run/", {"n": 17, "order": 2}, n_jobs=4)
+        >>> results = pipeline.run("sdrf.txt", "samples/", "annotation.tsv")
+    """
+
+    def __init__(self, out_dir, params=None, *, n_jobs=None, verbose=True):
+        self.out_dir = pathlib.Path(out_dir)
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.verbose = verbose
+        self.checkpoints = _Checkpoints(self.out_dir)
+
+    def _log(self, message):
+        if self.verbose:
+            print(f"[Pipeline] {message}", flush=True)
+
+    def ingest(self, sdrf_path, sample_dir):
+        df1, df2 = build_methylome_dataframes(
+            sdrf_path, sample_dir, groups=tuple(self.params["groups"]), cache_dir=self.out_dir / "ingest",
+        )
+        if df1 is None or df2 is None:
+            raise ValueError(f"No sample tables found for one of the groups {self.params['groups']}.")
+        return df1, df2
+
+    def split(self, df1, df2, manifest):
+        """Write one input partition per chromosome; return ``{chromosome: directory}``."""
+        annotation = AnnotationManifest(manifest)
+        common = df1.index.intersection(df2.index)
+        positions = annotation.positions(common)
+        if (positions < 0).any():
+            print(f"[Pipeline] warning: {int((positions < 0).sum())} CpGs missing from the manifest are skipped")
+        common, positions = common[positions >= 0], positions[positions >= 0]
+
+        chromosome = pd.Series(annotation.columns["Chromosome"][positions]).astype(str)
+        placed = ~chromosome.isin(["nan", "None", ""]).to_numpy()
+        common, positions, chromosome = common[placed], positions[placed], chromosome[placed].to_numpy()
+
+        values1, values2 = df1.to_numpy(), df2.to_numpy()
+        rows1, rows2 = df1.index.get_indexer(common), df2.index.get_indexer(common)
+
+        root = self.out_dir / "partitions"
+        partitions = {}
+        for chrom in sorted(pd.unique(chromosome), key=chromosome_sort):
+            rows = np.flatnonzero(chromosome == chrom)
+            order = rows[np.argsort(annotation.columns["Position"][positions[rows]], kind="stable")]
+            ids = common[order].to_numpy(dtype=str)
+            frame = pd.DataFrame({"Predictor": ids, **annotation.take(positions[order])})
+            part = {
+                "ids": ids,
+                "columns1": df1.columns.to_numpy(dtype=str),
+                "columns2": df2.columns.to_numpy(dtype=str),
+                "g1": np.asarray(values1[rows1[order]], dtype=np.float32),
+                "g2": np.asarray(values2[rows2[order]], dtype=np.float32),
+                "annotation": frame,
+            }
+            key = _key(
+                ids, part["columns1"], part["columns2"], part["g1"], part["g2"],
+                pd.util.hash_pandas_object(frame, index=False).to_numpy(),
+            )
+            checkpoints = _Checkpoints(root / chrom)
+            if not checkpoints.is_current("input", key):
+                checkpoints.store("input", key, part)
+            partitions[chrom] = checkpoints.directory
+
+        for stale in root.iterdir():
+            if stale.is_dir() and stale.name not in partitions:
+                shutil.rmtree(stale, ignore_errors=True)
+        return partitions
+
+    def run_partitions(self, partitions):
+        """Run every chromosome chain, as they finish; return ``{chromosome: signal key}``."""
+        keys = {}
+
+        def done(chrom, key, recomputed):
+            keys[chrom] = key
+            self._log(f"chromosome {chrom}: " + (", ".join(recomputed) if recomputed else "up to date"))
+
+        if self.n_jobs > 1 and len(partitions) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.n_jobs, len(partitions))) as pool:
+                futures = {
+                    pool.submit(_partition_chain, str(directory), self.params): chrom
+                    for chrom, directory in partitions.items()
+                }
+                for future in as_completed(futures):
+                    done(futures[future], *future.result())
+        else:
+            for chrom, directory in partitions.items():
+                done(chrom, *_partition_chain(str(directory), self.params))
+
+        return {chrom: keys[chrom] for chrom in partitions}
+
+    def results(self, partitions, partition_keys):
+        """Genome-wide table with q-values and ``Signal_Noise_Ratio``, in genomic order."""
+        key = _key("results", list(partition_keys.items()))
+        if self.checkpoints.is_current("results", key):
+            self._log("results: up to date")
+            return self.checkpoints.load("results"), key
+
+        frames = [_Checkpoints(directory).load("signal") for directory in partitions.values()]
+        results = pd.concat(frames, ignore_index=True)
+
+        qvals = _bh_qvalues(results["pvalue"].to_numpy(dtype=float))
+        results.insert(results.columns.get_loc("pvalue") + 1, "qvalue", qvals)
+        results["Signal_Noise_Ratio"] = results["Signal"] / np.nanmean(results["smooth_result"].to_numpy(dtype=float))
+
+        results = normalize_methylome(results, float_dtype=np.float64)
+        self.checkpoints.store("results", key, results)
+        self._log("results: recomputed")
+        return results, key
+
+    def plots(self, results, results_key):
+        key = _key("plots", results_key)
+        if self.checkpoints.is_current("plots", key):
+            self._log("plots: up to date")
+            return
+
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        from Display import plot_manhattan
+
+        out_file = self.out_dir / "manhattan.png"
+        plot_manhattan(results, "smooth_result", show=False, out_file=out_file)
+        plt.close("all")
+        self.checkpoints.store("plots", key, [str(out_file)])
+        self._log(f"plots: {out_file}")
+
+    def run(self, sdrf_path, sample_dir, manifest):
+        """Run or resume the whole pipeline and return the genome-wide results.
+
+        *manifest* is the annotation frame or the path of a tab- or
+        comma-separated annotation file (``Predictor`` or ``Markers``,
+        ``Chromosome``, ``Position``, optionally ``Gene Name``).
+        """
+        if not isinstance(manifest, pd.DataFrame):
+            sep = "," if str(manifest).lower().endswith(".csv") else "\t"
+            manifest = pd.read_csv(manifest, sep=sep, dtype={"Chromosome": str})
+
+        df1, df2 = self.ingest(sdrf_path, sample_dir)
+        partitions = self.split(df1, df2, manifest)
+        del df1, df2
+
+        partition_keys = self.run_partitions(partitions)
+        results, results_key = self.results(partitions, partition_keys)
+        if self.params["plots"]:
+            self.plots(results, results_key)
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run or resume the chromosome-partitioned methylome pipeline.")
+    parser.add_argument("--sdrf", required=True, help="SDRF file of the experiment")
+    parser.add_argument("--samples", required=True, help="directory of the per-sample tables")
+    parser.add_argument("--manifest", required=True, help="probe annotation (TSV or CSV)")
+    parser.add_argument("--out", required=True, help="output and checkpoint directory")
+    parser.add_argument("--groups", nargs=2, default=DEFAULT_PARAMS["groups"], metavar=("GROUP1", "GROUP2"))
+    parser.add_argument("--min-n", type=int, default=DEFAULT_PARAMS["min_n"])
+    parser.add_argument("--method", choices=("savgol", "mean"), default=DEFAULT_PARAMS["method"])
+    parser.add_argument("--n", type=int, default=DEFAULT_PARAMS["n"], help="smoothing window in CpGs")
+    parser.add_argument("--order", type=int, default=DEFAULT_PARAMS["order"], help="Savitzky-Golay order")
+    parser.add_argument("--snr-window", type=int, default=DEFAULT_PARAMS["snr_window"])
+    parser.add_argument("--no-plots", action="store_true")
+    parser.add_argument("--jobs", type=int, default=None, help="parallel chromosome chains (default: all CPUs)")
+    args = parser.parse_args(argv)
+
+    params = {
+        "groups": list(args.groups), "min_n": args.min_n, "method": args.method, "n": args.n,
+        "order": args.order, "snr_window": args.snr_window, "plots": not args.no_plots,
+    }
+    results = Pipeline(args.out, params, n_jobs=args.jobs).run(args.sdrf, args.samples, args.manifest)
+    print(f"[Pipeline] {len(results)} CpGs in {pathlib.Path(args.out) / 'results.pkl'}")
+
+
+instrument_module(__name__)
+
+
+if __name__ == "__main__":
+    main()
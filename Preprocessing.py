@@ -1,14 +1,181 @@
+import numpy as np
 import pandas as pd
 
+from Instrumentation import instrument_module
+from Utils import chromosome_sort
+
+ID_COLUMNS = ('Predictor', 'Reporter ID', 'CpG ID', 'Gene Name')
+
+
+def _clean_chromosome(chromosome):
+    return chromosome.astype(str).str.replace('.0', '', regex=False).str.strip()
+
+
+class AnnotationManifest:
+    """Annotation manifest prepared once for repeated merges on ``Predictor``.
+
+    The probe IDs are hashed a single time into a ``pandas.Index``; each
+    merge then looks up the statistics' IDs in it and gathers the annotation
+    columns with a positional take, instead of building a new hash join.
+    ``Markers`` is renamed to ``Predictor`` and ``Chromosome`` is cleaned as
+    in :func:`merge`.
+
+    Example:
+        >>> manifest = AnnotationManifest(annotation_df)
+        >>> merged = merge(stats_df, manifest)
+    """
+
+    def __init__(self, manifest):
+        manifest = manifest.rename(columns={'Markers': 'Predictor'})
+        duplicated = manifest['Predictor'].duplicated()
+        if duplicated.any():
+            print(f"[AnnotationManifest] keeping the first of {int(duplicated.sum())} duplicated probe IDs")
+            manifest = manifest.loc[~duplicated]
+
+        self.index = pd.Index(manifest['Predictor'].to_numpy(dtype=object), dtype=object)
+        self._last_lookup = None
+        self.columns = {
+            column: manifest[column].to_numpy()
+            for column in manifest.columns
+            if column != 'Predictor'
+        }
+        if 'Chromosome' in self.columns:
+            self.columns['Chromosome'] = _clean_chromosome(manifest['Chromosome']).to_numpy()
+
+    def positions(self, predictors):
+        """Row of each ID in the manifest, ``-1`` when absent.
+
+        The last lookup is remembered, so merging several tables that list the
+        same probes in the same order hashes their IDs only once.
+        """
+        keys = np.asarray(predictors, dtype=object)
+        if self._last_lookup is not None and np.array_equal(keys, self._last_lookup[0]):
+            return self._last_lookup[1]
+
+        positions = self.index.get_indexer(keys)
+        self._last_lookup = (keys, positions)
+        return positions
+
+    def take(self, positions, exclude=()):
+        """Annotation columns gathered at *positions*; ``-1`` rows are missing."""
+        return {
+            column: pd.api.extensions.take(values, positions, allow_fill=True)
+            for column, values in self.columns.items()
+            if column not in exclude
+        }
+
+
+def merge(df1, df2, *, return_unmatched=False):
+    if isinstance(df2, AnnotationManifest):
+        merged, positions = _merge_prepared(df1, df2)
+        if return_unmatched:
+            return merged, df1['Predictor'].to_numpy()[positions < 0]
+        return merged
 
-def merge(df1, df2):
     redundant_columns = df1.columns.intersection(df2.columns)
 
     df2 = df2.drop(columns=redundant_columns, errors='ignore')
     df2.rename(columns={'Markers': 'Predictor'}, inplace=True)
 
     df_merged = pd.merge(df1, df2, on='Predictor', how='left')
-    df_merged['Chromosome'] = df_merged['Chromosome'].astype(str).str.replace('.0', '', regex=False).str.strip()
+    df_merged['Chromosome'] = _clean_chromosome(df_merged['Chromosome'])
 
+    if return_unmatched:
+        return df_merged, df1.loc[~df1['Predictor'].isin(df2['Predictor']), 'Predictor'].to_numpy()
     return df_merged
 
+
+def _merge_prepared(df1, manifest, positions=None):
+    if positions is None:
+        positions = manifest.positions(df1['Predictor'])
+    annotation = manifest.take(positions, exclude=df1.columns)
+    merged = pd.concat([df1.reset_index(drop=True), pd.DataFrame(annotation)], axis=1)
+    return merged, positions
+
+
+def merge_many(tables, manifest):
+    """Merge several statistics tables with the same annotation manifest.
+
+    *manifest* is an :class:`AnnotationManifest` or a raw annotation frame,
+    prepared once here. Tables listing the same probes in the same order share
+    one ID lookup.
+
+    Returns
+    -------
+    list of DataFrame, dict
+        The merged tables, and for each table index the IDs missing from the
+        manifest.
+    """
+    if not isinstance(manifest, AnnotationManifest):
+        manifest = AnnotationManifest(manifest)
+
+    merged, unmatched = [], {}
+    for i, table in enumerate(tables):
+        frame, positions = _merge_prepared(table, manifest)
+        merged.append(frame)
+        unmatched[i] = table['Predictor'].to_numpy()[positions < 0]
+
+    return merged, unmatched
+
+
+def normalize_methylome(df, *, float_dtype=np.float32):
+    """Return a compact, typed copy of a merged methylome frame, sorted by genomic position.
+
+    * ``Chromosome`` becomes an ordered categorical following
+      :func:`Utils.chromosome_sort` (1…22, X, Y, others).
+    * ``Position`` becomes int32; rows without a chromosome or position are
+      dropped.
+    * Probe and gene identifiers become categoricals.
+    * Other float columns are stored as *float_dtype*.
+
+    Rows are sorted by (Chromosome, Position) on a fresh RangeIndex and the
+    frame is flagged for :func:`is_genomic_sorted`.
+    """
+    chromosome = _clean_chromosome(df['Chromosome'])
+    placed = (
+        df['Position'].notna().to_numpy()
+        & chromosome.notna().to_numpy()
+        & ~chromosome.isin(['nan', 'None', '']).to_numpy()
+    )
+    if not placed.all():
+        print(f"[normalize_methylome] dropping {int((~placed).sum())} rows without a genomic position")
+
+    out = df.loc[placed].copy()
+    chromosome = chromosome[placed]
+    categories = sorted(chromosome.unique(), key=chromosome_sort)
+    out['Chromosome'] = pd.Categorical(chromosome, categories=categories, ordered=True)
+
+    positions = out['Position'].to_numpy(dtype=np.int64)
+    if len(positions) and (positions.min() < 0 or positions.max() > np.iinfo(np.int32).max):
+        raise ValueError("Position values must fit in a non-negative int32.")
+    out['Position'] = positions.astype(np.int32)
+
+    for column in ID_COLUMNS:
+        if column in out.columns:
+            out[column] = out[column].astype('category')
+
+    for column in out.columns:
+        if pd.api.types.is_float_dtype(out[column].dtype):
+            out[column] = out[column].astype(float_dtype)
+
+    out = out.sort_values(['Chromosome', 'Position'], kind='stable', ignore_index=True)
+    out.attrs['genomic_sorted'] = True
+    return out
+
+
+def is_genomic_sorted(df):
+    """True if *df* comes from :func:`normalize_methylome` and is still in genomic order.
+
+    The flag is only a hint: pandas carries ``attrs`` through shuffles,
+    re-sorts and concatenations, so the order of the chromosome codes and of
+    the positions within each chromosome is always checked in one pass.
+    """
+    if not df.attrs.get('genomic_sorted', False) or not isinstance(df['Chromosome'].dtype, pd.CategoricalDtype):
+        return False
+    codes = df['Chromosome'].cat.codes.to_numpy()
+    positions = df['Position'].to_numpy()
+    same = codes[1:] == codes[:-1]
+    return bool((codes[1:] >= codes[:-1]).all() and (positions[1:][same] >= positions[:-1][same]).all())
+
+
+instrument_module(__name__)
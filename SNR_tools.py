@@ -1,32 +1,298 @@
 import numpy as np
+import pandas as pd
 
+from Instrumentation import instrument_module
+from Smoothing import genomic_order
 
-def signal_noise_for_gene(df, gene, smooth_column, bootstrap=False, noise_percentage=0.05):
-    df_gene = df[df['Gene Name'] == gene]
-    signal = df_gene[smooth_column].mean()
+_BOOTSTRAP_BLOCK = 1 << 22
 
-    df_noise = df[df['Gene Name'] != gene]
 
-    if bootstrap:
-        noise_values = df_noise[smooth_column].dropna().values
+def signal_noise_for_gene(df, gene, smooth_column, bootstrap=False, noise_percentage=0.05, rng=None, index=None):
+    if index is not None:
+        index.check(df)
+        mask = index.mask(index.gene(gene))
+        values = df[smooth_column].to_numpy(dtype=float)
+        signal = np.nanmean(values[mask]) if mask.any() else np.nan
+        noise_values = values[~mask]
+        noise_values = noise_values[~np.isnan(noise_values)]
+    else:
+        df_gene = df[df['Gene Name'] == gene]
+        signal = df_gene[smooth_column].mean()
+        noise_values = df[df['Gene Name'] != gene][smooth_column].dropna().values
 
+    if bootstrap:
         sample_size = max(1, int(noise_percentage * len(noise_values)))
-        noise_sample = np.random.choice(noise_values, size=sample_size, replace=True)
+        sampler = np.random if rng is None else rng
+        noise_sample = sampler.choice(noise_values, size=sample_size, replace=True)
         noise = noise_sample.mean()
     else:
-        df_noise = df_noise.copy()
-        noise = df_noise[smooth_column].mean()
+        noise = noise_values.mean()
 
     return signal / noise
 
 
-def signal_noise_pangenomic(df, smooth_column,window_size=3):
-    df_sorted = df.sort_values(by=['Chromosome', 'Position']).copy()
+def gene_mask(df, gene, index=None):
+    """Boolean mask of the rows annotated to *gene*; its complement is the noise.
+
+    With a :class:`Genomic_index.GenomicIndex` built from *df*, the rows are
+    looked up instead of comparing every ``Gene Name``.
+    """
+    if index is not None:
+        index.check(df)
+        return index.mask(index.gene(gene))
+    return (df['Gene Name'] == gene).to_numpy(dtype=bool)
+
+
+def signal_noise_from_mask(values, mask):
+    """Signal-to-noise ratio of each column of *values* for a precomputed gene mask.
+
+    *values* is a 1-D signal or a ``(rows, k)`` block of candidate signals;
+    missing values are skipped as in :func:`signal_noise_for_gene`.
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    inside = mask.astype(float)
+    outside = 1.0 - inside
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        signal = (inside @ filled) / (inside @ valid)
+        noise = (outside @ filled) / (outside @ valid)
+        return signal / noise
+
+
+def bootstrap_signal_noise(values, mask, noise_percentage=0.05, n_bootstrap=1000, *, seed=None,
+                           percentiles=(2.5, 97.5)):
+    """Bootstrap distribution of the signal-to-noise ratio for a gene mask.
+
+    As in :func:`signal_noise_for_gene` with ``bootstrap=True``, the signal is
+    the mean over the masked rows and each replicate's noise is the mean of
+    ``noise_percentage`` of the remaining non-missing values, drawn with
+    replacement. All replicates are drawn as index matrices from one
+    ``numpy.random.Generator``.
+
+    Parameters
+    ----------
+    values : array-like
+        Smoothed signal, one value per row.
+    mask : ndarray of bool
+        Rows belonging to the gene (see :func:`gene_mask`).
+    noise_percentage : float
+        Fraction of the noise values drawn per replicate.
+    n_bootstrap : int
+        Number of replicates.
+    seed : int, SeedSequence or Generator, optional
+        Passed to ``numpy.random.default_rng``; fixes the replicates.
+    percentiles : tuple of float
+        Bounds of the confidence interval.
+
+    Returns
+    -------
+    dict
+        ``mean`` of the replicates, ``conf_interval`` at *percentiles* and the
+        raw ``distribution``.
+    """
+    values = np.asarray(values, dtype=float)
+    rng = np.random.default_rng(seed)
+
+    signal = np.nanmean(values[mask]) if mask.any() else np.nan
+    noise_values = values[~mask]
+    noise_values = noise_values[~np.isnan(noise_values)]
+    sample_size = max(1, int(noise_percentage * len(noise_values)))
+
+    noise = np.empty(n_bootstrap)
+    rows = max(1, _BOOTSTRAP_BLOCK // sample_size)
+    for lo in range(0, n_bootstrap, rows):
+        hi = min(lo + rows, n_bootstrap)
+        draws = rng.integers(0, len(noise_values), size=(hi - lo, sample_size))
+        noise[lo:hi] = noise_values[draws].mean(axis=1)
+
+    distribution = signal / noise
+    return {
+        'mean': distribution.mean(),
+        'conf_interval': np.percentile(distribution, percentiles),
+        'distribution': distribution,
+    }
+
+
+def signal_noise_all_genes(df, smooth_column, bootstrap=False, noise_percentage=0.05, n_bootstrap=100, *,
+                           seed=None, percentiles=(2.5, 97.5)):
+    """Signal-to-noise ratio of every annotated gene, ranked.
+
+    Per-gene sums and counts come from one grouped reduction over
+    ``Gene Name``; each gene's noise mean is derived from the global totals
+    minus its own, so the cost is linear in the number of rows. The ratio
+    equals :func:`signal_noise_for_gene` for each gene.
+
+    With *bootstrap*, every replicate draws ``noise_percentage`` of all
+    non-missing values once; each gene's noise is the mean of the drawn values
+    outside that gene, obtained from per-gene sums of the draw.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Frame with ``Gene Name`` and *smooth_column*.
+    smooth_column : str
+        Column holding the (smoothed) signal.
+    bootstrap : bool
+        Add bootstrap mean and confidence interval columns.
+    noise_percentage, n_bootstrap, seed, percentiles
+        Bootstrap settings, as in :func:`bootstrap_signal_noise`.
+
+    Returns
+    -------
+    DataFrame
+        One row per gene, sorted by decreasing ratio: ``rank, Gene Name, n_cpg,
+        signal, noise, Signal_Noise_Ratio`` and, with *bootstrap*,
+        ``snr_mean, conf_lower, conf_upper``.
+    """
+    values = df[smooth_column].to_numpy(dtype=float)
+    codes, genes = pd.factorize(df['Gene Name'])
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+
+    known = codes >= 0
+    sums = np.bincount(codes[known], weights=filled[known], minlength=len(genes))
+    counts = np.bincount(codes[known], weights=valid[known], minlength=len(genes))
+    total, total_count = filled.sum(), valid.sum()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        signal = sums / counts
+        noise = (total - sums) / (total_count - counts)
+
+    result = pd.DataFrame({
+        'Gene Name': genes,
+        'n_cpg': counts.astype(np.int64),
+        'signal': signal,
+        'noise': noise,
+        'Signal_Noise_Ratio': signal / noise,
+    })
+
+    if bootstrap:
+        distribution = _bootstrap_all_genes(
+            filled[valid], codes[valid], signal, noise_percentage, n_bootstrap, seed
+        )
+        result['snr_mean'] = distribution.mean(axis=0)
+        bounds = np.percentile(distribution, percentiles, axis=0)
+        result['conf_lower'] = bounds[0]
+        result['conf_upper'] = bounds[1]
+
+    result = result.sort_values('Signal_Noise_Ratio', ascending=False, ignore_index=True)
+    result.insert(0, 'rank', np.arange(1, len(result) + 1))
+    return result
+
+
+def _bootstrap_all_genes(values, codes, signal, noise_percentage, n_bootstrap, seed):
+    """``(n_bootstrap, n_genes)`` bootstrap ratios sharing one draw per replicate."""
+    rng = np.random.default_rng(seed)
+    n_genes = len(signal)
+    slots = n_genes + 1  # slot 0 collects rows without a gene
+    sample_size = max(1, int(noise_percentage * len(values)))
+
+    ratios = np.empty((n_bootstrap, n_genes))
+    rows = max(1, _BOOTSTRAP_BLOCK // sample_size)
+    for lo in range(0, n_bootstrap, rows):
+        hi = min(lo + rows, n_bootstrap)
+        draws = rng.integers(0, len(values), size=(hi - lo, sample_size))
+        flat = (codes[draws] + 1 + slots * np.arange(hi - lo)[:, None]).ravel()
+
+        in_gene_sum = np.bincount(flat, weights=values[draws].ravel(), minlength=slots * (hi - lo))
+        in_gene_count = np.bincount(flat, minlength=slots * (hi - lo))
+        in_gene_sum = in_gene_sum.reshape(hi - lo, slots)[:, 1:]
+        in_gene_count = in_gene_count.reshape(hi - lo, slots)[:, 1:]
+
+        draw_sum = values[draws].sum(axis=1, keepdims=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            noise = (draw_sum - in_gene_sum) / (sample_size - in_gene_count)
+            ratios[lo:hi] = signal / noise
+
+    return ratios
+
+
+def rolling_signal(values, bounds, window_sizes):
+    """Centred rolling means of *values* for several window sizes at once.
+
+    Matches ``Series.rolling(w, center=True, min_periods=1).mean()`` applied to
+    each segment ``bounds[i]:bounds[i + 1]`` separately: windows are clipped at
+    the segment ends and missing values are skipped. Every window size is read
+    from the same prefix sums, so the cost is one cumulative sum plus one
+    vectorised difference per window.
+
+    *values* may also be an ``(n_rows, n_tracks)`` block, averaged along its
+    first axis.
+
+    Returns
+    -------
+    ndarray
+        ``values.shape + (len(window_sizes),)`` array of signals.
+    """
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+    zeros = np.zeros((1,) + values.shape[1:])
+    csum = np.concatenate((zeros, np.cumsum(np.where(missing, 0.0, values), axis=0)))
+    ccount = np.concatenate((zeros, np.cumsum(~missing, axis=0)))
+
+    bounds = np.asarray(bounds, dtype=np.int64)
+    lengths = np.diff(bounds)
+    lo = np.repeat(bounds[:-1], lengths)
+    hi = np.repeat(bounds[1:], lengths)
+    rows = np.arange(len(values))
+
+    signal = np.empty(values.shape + (len(window_sizes),))
+    for k, w in enumerate(window_sizes):
+        if w < 1:
+            raise ValueError("window sizes must be positive integers.")
+        w_lo = np.maximum(rows - w // 2, lo)
+        w_hi = np.minimum(rows + (w - 1 - w // 2) + 1, hi)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            signal[..., k] = (csum[w_hi] - csum[w_lo]) / (ccount[w_hi] - ccount[w_lo])
+
+    return signal
+
+
+def signal_noise_windows(df, smooth_column, window_sizes=(3, 5, 11, 21, 51)):
+    """Genome-wide signal to noise ratio for several window sizes in one pass.
+
+    The rolling signal of each window is computed chromosome by chromosome
+    (see :func:`rolling_signal`) and divided by the genome-wide mean of
+    *smooth_column*. The frame is sorted only if it is not already in genomic
+    order.
+
+    Returns
+    -------
+    DataFrame
+        ``Chromosome``, ``Position`` and one ``SNR_w<size>`` column per window,
+        in genomic order with the index labels of *df*.
+    """
+    df, bounds = genomic_order(df)
+
+    values = df[smooth_column].to_numpy(dtype=float)
+    ratios = rolling_signal(values, bounds, window_sizes) / np.nanmean(values)
+
+    result = pd.DataFrame({
+        'Chromosome': df['Chromosome'].to_numpy(),
+        'Position': df['Position'].to_numpy(),
+    }, index=df.index)
+    for k, w in enumerate(window_sizes):
+        result[f'SNR_w{w}'] = ratios[:, k]
+    return result
+
+
+def signal_noise_pangenomic(df, smooth_column, window_size=3):
+    """Genome-wide signal to noise ratio of *smooth_column*.
+
+    The signal is a centred rolling mean over *window_size* CpGs that stays
+    within each chromosome; the noise is the genome-wide mean. Returns the
+    frame in genomic order, with its original index labels and ``Signal`` and
+    ``Signal_Noise_Ratio`` added; the input is left untouched. Use :func:`signal_noise_windows` to scan
+    several window sizes at once.
+    """
+    df, bounds = genomic_order(df)
 
-    df_sorted['Signal'] = df_sorted[smooth_column].rolling(window=window_size, center=True, min_periods=1).mean()
+    values = df[smooth_column].to_numpy(dtype=float)
+    signal = rolling_signal(values, bounds, (window_size,))[:, 0]
 
-    global_noise = df_sorted[smooth_column].mean()
+    return df.assign(Signal=signal, Signal_Noise_Ratio=signal / np.nanmean(values))
 
-    df_sorted['Signal_Noise_Ratio'] = df_sorted['Signal'] / global_noise
 
-    return df_sorted
\ No newline at end of file
+instrument_module(__name__)
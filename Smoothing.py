@@ -1,11 +1,580 @@
-from scipy.signal import savgol_filter
+import math
+from functools import lru_cache
 
+import numpy as np
+import pandas as pd
 
-def mean_smoothing(df, target_column, n):
-    df['smooth_result'] = df[target_column].rolling(window=n, center=True).mean().fillna(df[target_column])
+from Instrumentation import instrument_module
+
+
+def chromosome_bounds(df, chrom_column="Chromosome"):
+    """Row offsets delimiting the runs of identical chromosomes.
+
+    Returns ``[0, b1, ..., len(df)]``: segment *i* spans rows
+    ``bounds[i]:bounds[i + 1]``. Rows are expected to be grouped by chromosome
+    (e.g. sorted by Chromosome and Position). Without a chromosome column the
+    whole frame is a single segment.
+    """
+    n_rows = len(df)
+    if chrom_column not in df.columns or n_rows == 0:
+        return np.array([0, n_rows], dtype=np.int64)
+
+    chrom = df[chrom_column]
+    if isinstance(chrom.dtype, pd.CategoricalDtype):
+        codes = chrom.cat.codes.to_numpy()
+    else:
+        codes = pd.factorize(chrom)[0]
+
+    breaks = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    return np.concatenate(([0], breaks, [n_rows])).astype(np.int64)
+
+
+def genomic_order(df):
+    """Return *df* grouped by chromosome and sorted by position, with its bounds.
+
+    The frame is sorted only if needed: one pass over ``Chromosome`` and
+    ``Position`` decides whether the current order can be kept. Sorting keeps
+    the index labels, so results can be aligned back to the input.
+    """
+    bounds = chromosome_bounds(df)
+    positions = df["Position"].to_numpy()
+    steps = np.diff(positions)
+    steps[bounds[1:-1] - 1] = 0  # position may drop at a chromosome change
+
+    if (steps >= 0).all() and len(bounds) - 1 == df["Chromosome"].nunique():
+        return df, bounds
+
+    df = df.sort_values(["Chromosome", "Position"], kind="stable")
+    return df, chromosome_bounds(df)
+
+
+@lru_cache(maxsize=256)
+def _savgol_hat(n, order):
+    """Hat matrix of a least-squares polynomial fit over a window of *n* points.
+
+    Row ``n // 2`` holds the Savitzky-Golay smoothing coefficients; the first
+    and last ``n // 2`` rows evaluate the fit at the window edges, which is how
+    ``scipy.signal.savgol_filter(mode="interp")`` treats the borders.
+    """
+    half = n // 2
+    t = (np.arange(n) - half) / max(half, 1)
+    vander = np.vander(t, order + 1, increasing=True)
+    hat = vander @ np.linalg.pinv(vander)
+    hat.setflags(write=False)
+    return hat
+
+
+def _check_savgol_params(n, order):
+    if n < 1 or n % 2 == 0:
+        raise ValueError("n must be a positive odd integer.")
+    if order < 0 or order >= n:
+        raise ValueError("order must be non-negative and smaller than n.")
+
+
+def _out_dtype(x):
+    return x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+
+
+def _savgol_rows(x, lo, hi, start, stop, n, order):
+    """Savitzky-Golay output for rows ``start:stop`` of the segment ``lo:hi``.
+
+    *x* is smoothed along its first axis (1-D signal or 2-D block). Only the
+    rows needed for the requested outputs are read, so the result does not
+    depend on what lies outside the segment. Segments shorter than *n* use the
+    largest odd window that fits.
+    """
+    from scipy.ndimage import correlate1d  # keep scipy out of the import of this module
+
+    m = min(n, hi - lo)
+    if m % 2 == 0:
+        m -= 1
+    hat = _savgol_hat(m, min(order, m - 1)).astype(_out_dtype(x), copy=False)
+    half = m // 2
+
+    out = np.empty((stop - start,) + x.shape[1:], dtype=_out_dtype(x))
+
+    a, b = max(start, lo + half), min(stop, hi - half)
+    if a < b:
+        window = x[a - half:b + half]
+        out[a - start:b - start] = correlate1d(window, hat[half], axis=0, mode="constant")[half:half + b - a]
+
+    a, b = start, min(stop, lo + half)
+    if a < b:
+        out[a - start:b - start] = hat[a - lo:b - lo] @ x[lo:lo + m]
+
+    a, b = max(start, hi - half), stop
+    if a < b:
+        out[a - start:b - start] = hat[a - hi + m:b - hi + m] @ x[hi - m:hi]
+
+    return out
+
+
+def _mean_rows(x, lo, hi, start, stop, n):
+    """Centred rolling mean for rows ``start:stop`` of the segment ``lo:hi``.
+
+    Follows ``Series.rolling(n, center=True).mean()``: rows whose window leaves
+    the segment or contains a missing value keep their raw value. Window sums
+    are accumulated in a fixed order, so a row gets the same value whatever
+    range it is computed in.
+    """
+    left, right = n // 2, n - 1 - n // 2
+    out = x[start:stop].astype(_out_dtype(x), copy=True)
+
+    a, b = max(start, lo + left), min(stop, hi - right)  # rows with a full window
+    if a < b:
+        window = x[a - left:b + right]
+        missing = np.isnan(window)
+        filled = np.where(missing, 0.0, window)
+        sums = filled[:b - a].astype(np.float64, copy=True)
+        for j in range(1, n):
+            sums += filled[j:j + b - a]
+        hits = np.concatenate((np.zeros((1,) + x.shape[1:], dtype=np.int64), np.cumsum(missing, axis=0)))
+        complete = hits[n:] == hits[:b - a]
+        out[a - start:b - start] = np.where(complete, sums / n, x[a:b])
+
+    return out
+
+
+def _segments(df, by_chromosome, index=None):
+    if not by_chromosome:
+        return np.array([0, len(df)], dtype=np.int64)
+    if index is not None:
+        index.check(df)
+        return index.bounds()
+    return chromosome_bounds(df)
+
+
+def mean_smoothing(df, target_column, n, *, output_column="smooth_result", by_chromosome=True, index=None):
+    """Centred moving average of *target_column* over *n* CpGs.
+
+    With *by_chromosome*, windows never cross a change of ``Chromosome``; the
+    segments are taken from *index* (a ``GenomicIndex`` of *df*) when given.
+    The result is written to *output_column* in place and the frame is
+    returned.
+    """
+    values = df[target_column].to_numpy(dtype=float)
+    bounds = _segments(df, by_chromosome, index)
+
+    result = np.empty_like(values)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        result[lo:hi] = _mean_rows(values, lo, hi, lo, hi, n)
+
+    df[output_column] = result
+    return df
+
+
+def savgol_smoothing(df, target_column, n, order, *, output_column="smooth_result", by_chromosome=True,
+                     index=None):
+    """Savitzky-Golay smoothing of *target_column* (window *n*, polynomial *order*).
+
+    With *by_chromosome*, each run of identical ``Chromosome`` values is
+    filtered on its own, with polynomial fits at both ends instead of windows
+    spilling into the neighbouring chromosome; the segments are taken from
+    *index* (a ``GenomicIndex`` of *df*) when given. Negative outputs are
+    clipped to 0. The result is written to *output_column* in place and the
+    frame is returned.
+    """
+    _check_savgol_params(n, order)
+    values = df[target_column].to_numpy(dtype=float)
+    bounds = _segments(df, by_chromosome, index)
+
+    result = np.empty_like(values)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        result[lo:hi] = _savgol_rows(values, lo, hi, lo, hi, n, order)
+
+    df[output_column] = np.maximum(result, 0)
     return df
 
-def savgol_smoothing(df, target_column, n, order):
-    df['smooth_result'] = savgol_filter(df[target_column], n, order)
-    df["smooth_result"] = df["smooth_result"].clip(lower=0)
-    return df
\ No newline at end of file
+
+def smooth_matrix(block, method, n, order=0, *, bounds=None, dtype=np.float64, chunk_rows=65536):
+    """Smooth every column of a CpG × samples block along the CpG axis.
+
+    Applies the smoother of :func:`mean_smoothing` (``method="mean"``) or
+    :func:`savgol_smoothing` (``method="savgol"``, without the clipping at 0)
+    to all columns at once, one vectorised call per chunk of rows. Rows must
+    be in genomic order; *bounds* delimits the chromosome segments (default:
+    one segment), e.g. from :func:`genomic_order` on the annotation the
+    block was aligned to.
+
+    Chunks of *chunk_rows* rows are read together with the *n* rows around
+    them, so memory-mapped blocks are never loaded whole and every row gets
+    the same value as in a single pass. With ``dtype=np.float32`` the chunks
+    are converted and smoothed in single precision.
+
+    Returns an array of *dtype*, or a DataFrame with the same index and
+    columns when *block* is one.
+    """
+    if method == "savgol":
+        _check_savgol_params(n, order)
+    elif method != "mean":
+        raise ValueError(f"Unknown smoothing method: {method!r}")
+
+    frame = block if isinstance(block, pd.DataFrame) else None
+    values = block.to_numpy() if frame is not None else block
+    if values.ndim != 2:
+        raise ValueError("block must be 2-D (CpGs × samples).")
+    if bounds is None:
+        bounds = np.array([0, len(values)], dtype=np.int64)
+
+    out = np.empty(values.shape, dtype=dtype)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        for start in range(lo, hi, chunk_rows):
+            stop = min(start + chunk_rows, hi)
+            first, last = max(lo, start - n), min(hi, stop + n)
+            window = np.asarray(values[first:last], dtype=dtype)
+            rows = (window, lo - first, hi - first, start - first, stop - first)
+            if method == "savgol":
+                out[start:stop] = _savgol_rows(*rows, n, order)
+            else:
+                out[start:stop] = _mean_rows(*rows, n)
+
+    if frame is not None:
+        return pd.DataFrame(out, index=frame.index, columns=frame.columns)
+    return out
+
+
+# (1 - u^3)^3 = 1 - 3u^3 + 3u^6 - u^9, as (power, coefficient) pairs
+_TRICUBE = ((0, 1.0), (3, -3.0), (6, 3.0), (9, -1.0))
+
+
+def _power_sums(prefixes, a, b, q, left):
+    """``Σ_j w_j f(|x_j - q|)`` over rows ``a:b``, *f* being the tricube polynomial.
+
+    Each of *prefixes* holds, in column *m*, the prefix sums of
+    ``w_j * x_j^m`` for ``m = 0..9``; the powers of the distance are expanded binomially around
+    the query point *q*. With *left*, the rows lie at or before the query
+    (``u = q - x``), otherwise after it (``u = x - q``).
+    """
+    neg_q = [np.ones_like(q)]
+    for _ in range(9):
+        neg_q.append(neg_q[-1] * -q)
+
+    coef = np.zeros((len(q), 10))
+    for k, c in _TRICUBE:
+        sign = -c if left and k % 2 else c
+        for m in range(k + 1):
+            coef[:, m] += sign * math.comb(k, m) * neg_q[k - m]
+
+    return [np.einsum("im,im->i", coef, prefix[b] - prefix[a]) for prefix in prefixes]
+
+
+def _bp_rows(values, positions, half_width, kernel):
+    """Weighted mean of one segment over windows of ±*half_width* bp.
+
+    *positions* must be sorted. Window bounds come from ``searchsorted`` and
+    window sums from prefix sums, so the cost does not depend on how many
+    CpGs a window holds. For the tricube kernel the weight is expanded into
+    powers of the distance; to keep that expansion well conditioned,
+    positions are measured in units of *half_width* from the start of their
+    bin of *half_width* bp, and each half window is split into the (at most
+    two) bins it covers.
+    """
+    missing = np.isnan(values)
+    filled = np.where(missing, 0.0, values)
+    valid = (~missing).astype(float)
+    first = np.searchsorted(positions, positions - half_width, side="left")
+    stop = np.searchsorted(positions, positions + half_width, side="right")
+
+    if kernel == "boxcar":
+        csum = np.concatenate(([0.0], np.cumsum(filled)))
+        ccount = np.concatenate(([0.0], np.cumsum(valid)))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (csum[stop] - csum[first]) / (ccount[stop] - ccount[first])
+
+    offset = (positions - positions[0]).astype(float)
+    bins = np.floor(offset / half_width)
+    x = (offset - bins * half_width) / half_width
+    bin_first = np.searchsorted(bins, bins, side="left")
+    bin_stop = np.searchsorted(bins, bins, side="right")
+
+    powers = x[:, None] ** np.arange(10)
+    zero = np.zeros((1, 10))
+    weighted = np.vstack((zero, np.cumsum(powers * filled[:, None], axis=0)))
+    counted = np.vstack((zero, np.cumsum(powers * valid[:, None], axis=0)))
+
+    rows = np.arange(len(values))
+    split_left = np.maximum(first, bin_first)
+    split_right = np.minimum(stop, bin_stop)
+    parts = (
+        (first, split_left, x + 1, True),        # previous bin
+        (split_left, rows + 1, x, True),         # own bin, up to and including the centre
+        (rows + 1, split_right, x, False),       # own bin, after the centre
+        (split_right, stop, x - 1, False),       # next bin
+    )
+    num, den = np.sum([_power_sums((weighted, counted), a, b, q, left) for a, b, q, left in parts], axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 1e-12, num / den, np.nan)
+
+
+def bp_smoothing(df, target_column, width, kernel="boxcar", *, output_column="smooth_result",
+                 by_chromosome=True, index=None):
+    """Smooth *target_column* over windows of *width* bp centred on each CpG.
+
+    Unlike :func:`mean_smoothing`, the window follows ``Position`` rather than
+    a number of rows, so CpGs packed in an island and isolated probes are
+    each averaged with the neighbours actually close to them. ``"boxcar"``
+    averages the values within ``±width / 2`` bp; ``"tricube"`` weights them
+    by ``(1 - (|d| / (width / 2))^3)^3``. Missing values are skipped and rows
+    without any value in their window get NaN. The cost is linear in the
+    number of rows whatever the width.
+
+    Rows must be sorted by position within each chromosome (see
+    :func:`genomic_order`); with *by_chromosome* the segments are taken from
+    *index* (a ``GenomicIndex`` of *df*) when given. The result is written to
+    *output_column* in place and the frame is returned.
+    """
+    if kernel not in ("boxcar", "tricube"):
+        raise ValueError(f"Unknown kernel: {kernel!r}")
+    if not width > 0:
+        raise ValueError("width must be positive.")
+
+    values = df[target_column].to_numpy(dtype=float)
+    positions = df["Position"].to_numpy()
+    bounds = _segments(df, by_chromosome, index)
+
+    result = np.empty_like(values)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if (np.diff(positions[lo:hi]) < 0).any():
+            raise ValueError("Positions must be sorted within each chromosome; see genomic_order.")
+        result[lo:hi] = _bp_rows(values[lo:hi], positions[lo:hi], width / 2, kernel)
+
+    df[output_column] = result
+    return df
+
+
+class IncrementalSmoother:
+    """Smoothing of one column that is kept up to date as values change.
+
+    The first smoothing is a full pass, as :func:`mean_smoothing` or
+    :func:`savgol_smoothing` with the same arguments. :meth:`update` then
+    recomputes only the outputs whose window touches a changed row (changed
+    rows ± half a window, clipped to the chromosome, widened to the whole
+    edge fit for Savitzky-Golay rows near a chromosome end) and writes them
+    back to *output_column*. The result is identical to a full recompute, and
+    an update costs time proportional to the number of affected rows.
+
+    Example:
+        >>> smoother = IncrementalSmoother(df_merged, "log10_pvalue", "savgol", 11, 2)
+        >>> df_merged.loc[retested, "log10_pvalue"] = new_values
+        >>> smoother.update(df_merged)
+    """
+
+    # Above this many ranges, the output column is written back in one piece.
+    MAX_PARTIAL_WRITES = 64
+    # A range costs about as much as smoothing this many rows in one call.
+    ROWS_PER_RANGE = 2000
+
+    def __init__(self, df, target_column, method, n, order=0, *, output_column="smooth_result",
+                 by_chromosome=True, index=None):
+        if method == "savgol":
+            _check_savgol_params(n, order)
+        elif method != "mean":
+            raise ValueError(f"Unknown smoothing method: {method!r}")
+
+        self.target_column = target_column
+        self.output_column = output_column
+        self.method, self.n, self.order = method, n, order
+        self.bounds = _segments(df, by_chromosome, index)
+        self.values = df[target_column].to_numpy(dtype=float, copy=True)
+        self.result = np.empty_like(self.values)
+        for lo, hi in zip(self.bounds[:-1], self.bounds[1:]):
+            self._compute(lo, hi, lo, hi)
+        df[output_column] = self.result.copy()
+
+    def _compute(self, lo, hi, start, stop):
+        if self.method == "savgol":
+            self.result[start:stop] = np.maximum(_savgol_rows(self.values, lo, hi, start, stop, self.n, self.order), 0)
+        else:
+            self.result[start:stop] = _mean_rows(self.values, lo, hi, start, stop, self.n)
+
+    def dirty_ranges(self, rows):
+        """Output ranges ``[(start, stop), ...]`` affected by a change of *rows*."""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if len(rows) == 0:
+            return []
+
+        segment = np.searchsorted(self.bounds, rows, side="right") - 1
+        lo, hi = self.bounds[segment], self.bounds[segment + 1]
+        if self.method == "savgol":
+            before = after = self.n // 2
+        else:
+            # Output i reads rows i - n//2 .. i + right, so row r is read by r - right .. r + n//2.
+            before, after = self.n - 1 - self.n // 2, self.n // 2
+        start = np.maximum(rows - before, lo)
+        stop = np.minimum(rows + after + 1, hi)
+
+        if self.method == "savgol":
+            # Edge rows come from one polynomial fit over the first/last m rows,
+            # so a change there moves the whole edge.
+            m = np.minimum(self.n, hi - lo)
+            half = (m - (m % 2 == 0)) // 2
+            start = np.where(start <= lo + half, lo, start)
+            stop = np.where(stop >= hi - half, hi, stop)
+
+        # Merge overlapping ranges; ranges are clipped, so they never overlap across segments.
+        new_range = np.concatenate(([True], start[1:] >= np.maximum.accumulate(stop)[:-1]))
+        first = np.flatnonzero(new_range)
+        return list(zip(start[first], np.maximum.reduceat(stop, first)))
+
+    def update(self, df, rows=None):
+        """Re-smooth after *df[target_column]* changed and write the new outputs.
+
+        *rows* are the positions (``iloc``) of the changed rows; when omitted,
+        they are found by comparing the column with the values of the last
+        update. Returns the recomputed ``(start, stop)`` ranges.
+        """
+        if len(df) != len(self.values):
+            raise ValueError("The frame changed length; build a new IncrementalSmoother.")
+
+        current = df[self.target_column].to_numpy(dtype=float)
+        if rows is None:
+            same = (current == self.values) | (np.isnan(current) & np.isnan(self.values))
+            rows = np.flatnonzero(~same)
+        rows = np.asarray(rows, dtype=np.int64)
+        self.values[rows] = current[rows]
+
+        ranges = self.dirty_ranges(rows)
+        if len(ranges) > len(self.values) // self.ROWS_PER_RANGE:
+            # Many scattered changes: whole chromosomes are cheaper than one call per range.
+            touched = np.unique(np.searchsorted(self.bounds, [start for start, _ in ranges], side="right") - 1)
+            ranges = [(self.bounds[s], self.bounds[s + 1]) for s in touched]
+        for start, stop in ranges:
+            segment = np.searchsorted(self.bounds, start, side="right") - 1
+            self._compute(self.bounds[segment], self.bounds[segment + 1], start, stop)
+
+        if len(ranges) > self.MAX_PARTIAL_WRITES or self.output_column not in df.columns:
+            df[self.output_column] = self.result.copy()
+        else:
+            column = df.columns.get_loc(self.output_column)
+            for start, stop in ranges:
+                df.iloc[start:stop, column] = self.result[start:stop]
+        return ranges
+
+
+def _window_extent(method, n):
+    """Rows before and after the centre covered by a window of *n* CpGs."""
+    if method == "savgol":
+        return n // 2, n // 2
+    return n // 2, n - 1 - n // 2
+
+
+def kernel_bank(specs):
+    """Stack the centred weights of several smoothers into one matrix.
+
+    *specs* is a sequence of ``(method, n, order)`` with method ``"mean"`` or
+    ``"savgol"``. Returns a ``(len(specs), width)`` array, each kernel
+    zero-padded to the widest window and aligned on the centre column.
+    """
+    reach = max(max(_window_extent(method, n)) for method, n, _ in specs)
+    centre = reach
+    bank = np.zeros((len(specs), 2 * reach + 1))
+
+    for k, (method, n, order) in enumerate(specs):
+        left, right = _window_extent(method, n)
+        if method == "savgol":
+            _check_savgol_params(n, order)
+            bank[k, centre - left:centre + right + 1] = _savgol_hat(n, order)[n // 2]
+        elif method == "mean":
+            bank[k, centre - left:centre + right + 1] = 1.0 / n
+        else:
+            raise ValueError(f"Unknown smoothing method: {method!r}")
+
+    return bank
+
+
+def _trace_rows(method, n, order, length):
+    """Trace of the smoothing matrix of one segment of *length* rows."""
+    if method == "mean":
+        if length < n:
+            return float(length)  # every window leaves the segment: raw values are kept
+        return (length - n + 1) / n + (n - 1)
+
+    m = min(n, length)
+    if m % 2 == 0:
+        m -= 1
+    hat = _savgol_hat(m, min(order, m - 1))
+    half = m // 2
+    centre = hat[half, half]
+    return (length - 2 * half) * centre + (np.trace(hat) - centre)
+
+
+def smoother_dof(specs, bounds):
+    """Effective degrees of freedom of each smoother of *specs*.
+
+    The trace of the linear smoothing matrix, i.e. the sum of the weights each
+    output row gives to its own input, over the segments delimited by
+    *bounds*: Savitzky-Golay interior rows contribute the centre coefficient
+    of the hat matrix and the polynomial fits at segment ends add up to
+    ``order + 1`` per end; moving-average rows near the ends keep their raw
+    value and count as one. Missing values and the clipping of negative
+    Savitzky-Golay outputs are ignored.
+
+    Returns
+    -------
+    ndarray
+        ``(len(bounds) - 1, len(specs))`` traces, one row per segment; sum
+        over axis 0 for the whole genome.
+    """
+    lengths = np.diff(np.asarray(bounds, dtype=np.int64))
+    dof = np.empty((len(lengths), len(specs)))
+    for k, (method, n, order) in enumerate(specs):
+        if method == "savgol":
+            _check_savgol_params(n, order)
+        elif method != "mean":
+            raise ValueError(f"Unknown smoothing method: {method!r}")
+        dof[:, k] = [_trace_rows(method, n, order, length) if length else 0.0 for length in lengths]
+    return dof
+
+
+def smooth_bank(values, bounds, specs, *, chunk_rows=65536):
+    """Smooth one signal with every smoother of *specs* in a single pass.
+
+    Returns an ``(len(values), len(specs))`` array whose column *k* equals the
+    ``smooth_result`` that :func:`mean_smoothing` / :func:`savgol_smoothing`
+    would produce for ``specs[k]`` on the segments delimited by *bounds*.
+    Interior rows come from one matrix product of the sliding windows with
+    :func:`kernel_bank`; rows near segment ends are then patched per kernel.
+    """
+    values = np.asarray(values, dtype=float)
+    bank = kernel_bank(specs)
+    width = bank.shape[1]
+    support = (bank != 0).astype(float)
+    is_mean = np.array([method == "mean" for method, _, _ in specs])
+    pad = np.zeros(width // 2)
+    out = np.empty((len(values), len(specs)))
+
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        segment = values[lo:hi]
+        missing = np.isnan(segment)
+        windows = np.lib.stride_tricks.sliding_window_view(
+            np.concatenate((pad, np.where(missing, 0.0, segment), pad)), width
+        )
+        hits = np.lib.stride_tricks.sliding_window_view(
+            np.concatenate((pad, missing.astype(float), pad)), width
+        ) if missing.any() else None
+
+        for r0 in range(0, hi - lo, chunk_rows):
+            r1 = min(r0 + chunk_rows, hi - lo)
+            block = windows[r0:r1] @ bank.T
+            if hits is not None:
+                touched = (hits[r0:r1] @ support.T) > 0
+                block = np.where(touched, np.where(is_mean, segment[r0:r1, None], np.nan), block)
+            out[lo + r0:lo + r1] = block
+
+        for k, (method, n, order) in enumerate(specs):
+            left, right = _window_extent(method, n)
+            if hi - lo < n:
+                edges = [(lo, hi)]
+            else:
+                edges = [(lo, lo + left), (hi - right, hi)]
+            for a, b in edges:
+                if method == "savgol":
+                    out[a:b, k] = _savgol_rows(values, lo, hi, a, b, n, order)
+                else:
+                    out[a:b, k] = values[a:b]
+
+    out[:, ~is_mean] = np.maximum(out[:, ~is_mean], 0)
+    return out
+
+
+instrument_module(__name__)
@@ -1,24 +1,21 @@
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-import seaborn as sns
 
-from SNR_tools import signal_noise_for_gene
-from Smoothing import savgol_smoothing
+from Instrumentation import instrument_module
+from Smoothing import chromosome_bounds, smoother_dof
 
 
-def savgol_looker(df_merged):
-    plt.rcParams['font.family'] = 'Arial'
+def savgol_looker(df_merged, target_column, gene='MMACHC', n_jobs=None):
+    # Plotting and the sweep are imported here so that the helpers below stay
+    # importable by compute-only code without matplotlib or seaborn.
+    import seaborn as sns
+    from matplotlib import pyplot as plt
 
-    results = []
+    from Maths import savgol_grid, smoothing_sweep
 
-    for n in range(3, 101, 2):
-        for order in range(1, min(n, 10)):
-            savgol_smoothing(df_merged, n, order)
-            signal_noise_ratio = signal_noise_for_gene(df_merged, 'MMACHC', 'smooth_result')
-            results.append({'n': n, 'order': order, 'signal_noise': signal_noise_ratio})
+    plt.rcParams['font.family'] = 'Arial'
 
-    df_results = pd.DataFrame(results)
+    df_results = smoothing_sweep(df_merged, target_column, gene, savgol_grid(), n_jobs=n_jobs)
 
     plt.figure(figsize=(12, 6))
     for order_val in df_results['order'].unique():
@@ -70,6 +67,82 @@ def evaluate_performance(df, target_column, smoothed_column, k_params):
         'k_params': k_params
     }
 
+def evaluate_performance_batch(df, target_column, candidates, k_params=None, *, specs=None, labels=None,
+                               by_chromosome=False, memory_budget=256 * 1024 ** 2):
+    """Score many smoothed signals of *target_column* in one vectorised pass.
+
+    *candidates* is an ``(n_rows, K)`` block (e.g. from
+    ``Smoothing.smooth_bank``) or a list of column names of *df*. Returns, per
+    candidate, the MSE, Gaussian log-likelihood, AIC and BIC of
+    :func:`evaluate_performance`. Rows where the target or a candidate is
+    missing are left out of that candidate's score.
+
+    *k_params* is a number or one value per candidate. When omitted, *specs*
+    (the ``(method, n, order)`` list that produced the block) gives the
+    effective degrees of freedom, the trace of each smoother
+    (``Smoothing.smoother_dof``).
+
+    With *by_chromosome*, one row per chromosome and candidate is returned,
+    with the degrees of freedom of that chromosome only; the frame must be
+    grouped by chromosome.
+    """
+    y_true = df[target_column].to_numpy(dtype=float)
+    if isinstance(candidates, (list, tuple)) and candidates and isinstance(candidates[0], str):
+        labels = list(candidates) if labels is None else labels
+        candidates = df[list(candidates)].to_numpy(dtype=float)
+    candidates = np.asarray(candidates, dtype=float).reshape(len(y_true), -1)
+    n_candidates = candidates.shape[1]
+
+    if labels is None:
+        labels = [f"{m}_n{n}_o{o}" for m, n, o in specs] if specs is not None else list(range(n_candidates))
+
+    bounds = chromosome_bounds(df)
+    if k_params is None:
+        if specs is None:
+            raise ValueError("Pass k_params or the specs of the smoothers.")
+        k_params = smoother_dof(specs, bounds)
+        if not by_chromosome:
+            k_params = k_params.sum(axis=0)
+    n_rows_out = len(bounds) - 1 if by_chromosome else 1
+    k_params = np.broadcast_to(np.asarray(k_params, dtype=float), (n_rows_out, n_candidates))
+
+    # Squared residuals summed per chromosome, a block of candidates at a time.
+    sse = np.empty((len(bounds) - 1, n_candidates))
+    count = np.empty_like(sse)
+    step = max(1, memory_budget // (9 * max(len(y_true), 1)))
+    for j in range(0, n_candidates, step):
+        residuals = y_true[:, None] - candidates[:, j:j + step]
+        missing = np.isnan(residuals)
+        residuals[missing] = 0.0
+        np.square(residuals, out=residuals)
+        for s, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            sse[s, j:j + step] = residuals[lo:hi].sum(axis=0)
+            count[s, j:j + step] = (hi - lo) - np.count_nonzero(missing[lo:hi], axis=0)
+
+    if not by_chromosome:
+        sse, count = sse.sum(axis=0, keepdims=True), count.sum(axis=0, keepdims=True)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mse = sse / count
+        log_mse = np.log(mse)
+        result = {
+            'MSE': mse,
+            'log_likelihood': -0.5 * count * (np.log(2 * np.pi * mse) + 1),
+            'AIC': count * log_mse + 2 * k_params,
+            'BIC': count * log_mse + k_params * np.log(count),
+            'length': count.astype(np.int64),
+            'k_params': k_params,
+        }
+
+    scores = pd.DataFrame({name: values.ravel() for name, values in result.items()})
+    scores.insert(0, 'candidate', np.tile(np.asarray(labels, dtype=object), len(sse)))
+    if by_chromosome:
+        chromosomes = df['Chromosome'].to_numpy()[bounds[:-1]]
+        scores.insert(0, 'Chromosome', np.repeat(chromosomes, n_candidates))
+        return scores
+    return scores.set_index('candidate')
+
+
 def chromosome_sort(chrom):
     if chrom.isdigit():
         return int(chrom)
@@ -80,3 +153,5 @@ def chromosome_sort(chrom):
     else:
         return 25
 
+
+instrument_module(__name__, skip=('chromosome_sort',))
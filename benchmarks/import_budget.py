@@ -0,0 +1,89 @@
+"""Check the import cost of the compute modules against a budget.
+
+Usage::
+
+    python benchmarks/import_budget.py            # exit code 1 on a violation
+    python benchmarks/import_budget.py --runs 7 --scale 1.5
+
+Each module is imported in a fresh interpreter, as a batch worker or a
+process-pool child would. Two things are checked:
+
+* heavy optional stacks (plotting, sklearn, statsmodels, scipy.stats) must not
+  be loaded by the compute-only modules at all;
+* the median import time on top of ``numpy`` and ``pandas`` must stay within
+  the module's budget in milliseconds. ``--scale`` loosens the budgets on
+  slow machines.
+"""
+import argparse
+import pathlib
+import statistics
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+HEAVY = ("matplotlib", "seaborn", "sklearn", "statsmodels", "scipy.stats", "pingouin", "tqdm")
+
+# module -> (budget in ms above numpy + pandas, modules that must stay unloaded)
+BUDGETS = {
+    "Instrumentation": (20, HEAVY + ("scipy",)),
+    "Smoothing": (30, HEAVY + ("scipy",)),
+    "SNR_tools": (30, HEAVY + ("scipy",)),
+    "Preprocessing": (30, HEAVY + ("scipy",)),
+    "Genomic_index": (30, HEAVY + ("scipy",)),
+    "Peaks": (30, HEAVY + ("scipy",)),
+    "Utils": (30, HEAVY + ("scipy",)),
+    "Microarray_handler": (50, HEAVY + ("scipy",)),
+    "Maths": (50, HEAVY),
+}
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import numpy, pandas
+base = time.perf_counter()
+{imports}
+end = time.perf_counter()
+print(base - start, end - base)
+print(" ".join(sorted(sys.modules)))
+"""
+
+
+def measure(module, runs=5):
+    """Median import time of *module* in ms, and the modules it left loaded."""
+    imports = f"import {module}" if module else ""
+    times = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(imports=imports)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.splitlines()
+        times.append(float(out[0].split()[1]) * 1000)
+        loaded = set(out[1].split())
+    return statistics.median(times), loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget")
+    parser.add_argument("modules", nargs="*", help="modules to check (default: all)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for module in args.modules or BUDGETS:
+        budget, forbidden = BUDGETS[module]
+        elapsed, loaded = measure(module, args.runs)
+        leaked = [name for name in forbidden if name in loaded]
+        ok = elapsed <= budget * args.scale and not leaked
+        failures += not ok
+        line = f"{'ok  ' if ok else 'FAIL'} {module:20s} {elapsed:7.1f} ms (budget {budget * args.scale:.0f} ms)"
+        if leaked:
+            line += f"  loads {', '.join(leaked)}"
+        print(line)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
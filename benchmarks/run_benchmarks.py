@@ -0,0 +1,200 @@
+"""Time and measure the main entry points on synthetic datasets.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py --scales 27k 450k --repeat 3
+    python benchmarks/run_benchmarks.py --scales 850k --cases ttest smoothing
+
+Each run appends one record per scale to a JSON history (default
+``benchmarks/history.json``) with the wall time of every case (best and mean
+of ``--repeat`` runs) and its peak traced memory, together with the commit
+and library versions. The previous record of the same scale is printed
+alongside, so regressions show up directly. Plots are drawn with the Agg
+backend and nothing is downloaded.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+HERE = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import synthetic  # noqa: E402
+
+DEFAULT_HISTORY = HERE / "history.json"
+
+
+def _cases(data):
+    """``name -> callable`` of the benchmarked operations on prepared *data*."""
+    import matplotlib.pyplot as plt
+
+    from Display import plot_manhattan, plot_manhattan2
+    from Maths import (bootstrap_distribution, bootstrap_mean_with_CI, bootstrap_with_confidence,
+                       run_bayesian_methylation_test, run_methylation_ttest)
+    from Microarray_handler import build_methylome_dataframes
+    from SNR_tools import signal_noise_all_genes, signal_noise_pangenomic
+    from Smoothing import mean_smoothing, savgol_smoothing
+
+    g1, g2 = data["groups"]
+    merged, gene, smoothed = data["merged"], data["gene"], data["smoothed"]
+
+    def manhattan():
+        plot_manhattan(smoothed, "smooth_result", show=False, out_file=data["tmp"] / "manhattan.png")
+        plt.close("all")
+
+    def manhattan2():
+        top = signal_noise_all_genes(smoothed, "smooth_result").head(20)
+        plot_manhattan2(smoothed, top, show=False, out_file=data["tmp"] / "manhattan2.png")
+        plt.close("all")
+
+    return {
+        "build_methylome_dataframes": lambda: build_methylome_dataframes(
+            data["sdrf"], data["samples"], groups=("Newborns", "Nonagenarians")
+        ),
+        "run_methylation_ttest": lambda: run_methylation_ttest(g1, g2, progress=False),
+        "run_bayesian_methylation_test": lambda: run_bayesian_methylation_test(g1, g2),
+        "mean_smoothing": lambda: mean_smoothing(merged, "log10_pvalue", 5, output_column="bench_mean"),
+        "savgol_smoothing": lambda: savgol_smoothing(merged, "log10_pvalue", 11, 2, output_column="bench_savgol"),
+        "bootstrap_distribution": lambda: bootstrap_distribution(smoothed, gene, "smooth_result", seed=0),
+        "bootstrap_mean_with_CI": lambda: bootstrap_mean_with_CI(merged, gene, "log10_pvalue", seed=0),
+        "bootstrap_with_confidence": lambda: bootstrap_with_confidence(smoothed, gene, "smooth_result", seed=0),
+        "signal_noise_pangenomic": lambda: signal_noise_pangenomic(smoothed, "smooth_result"),
+        "plot_manhattan": manhattan,
+        "plot_manhattan2": manhattan2,
+    }
+
+
+def _prepare(scale, n_samples, seed, tmp):
+    from Smoothing import savgol_smoothing
+
+    n_cpg = synthetic.n_cpg_for(scale)
+    manifest = synthetic.make_manifest(n_cpg, seed=seed)
+    groups = synthetic.make_groups(manifest, n_samples=n_samples, seed=seed)
+    sdrf, samples = synthetic.write_dataset(tmp, manifest, groups)
+    merged = synthetic.make_merged(manifest, seed=seed)
+    smoothed = savgol_smoothing(merged.copy(), "log10_pvalue", 11, 2)
+    return {
+        "n_cpg": n_cpg, "groups": groups, "sdrf": sdrf, "samples": samples, "merged": merged,
+        "smoothed": smoothed, "gene": synthetic.busiest_gene(merged), "tmp": tmp,
+    }
+
+
+def _measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {"best_s": min(times), "mean_s": float(np.mean(times)), "repeat": repeat, "peak_mib": peak / 2 ** 20}
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def load_history(path):
+    path = pathlib.Path(path)
+    return json.loads(path.read_text()) if path.exists() else []
+
+
+def _previous(history, scale, n_samples):
+    for record in reversed(history):
+        if record["scale"] == scale and record["n_samples"] == list(n_samples):
+            return record
+    return None
+
+
+def run(scales, cases=None, repeat=3, n_samples=(8, 8), seed=0, history_path=DEFAULT_HISTORY):
+    """Benchmark every case at every scale and append the records to the history."""
+    history = load_history(history_path)
+    environment = _environment()
+    records = []
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory(prefix="smoothed-methylome-bench-") as tmp:
+            print(f"== {scale}: generating data", flush=True)
+            data = _prepare(scale, n_samples, seed, pathlib.Path(tmp))
+            available = _cases(data)
+            selected = [name for name in available if not cases or any(c in name for c in cases)]
+
+            previous = _previous(history, scale, n_samples)
+            results = {}
+            for name in selected:
+                results[name] = _measure(available[name], repeat)
+                line = f"{name:32s} {results[name]['best_s']:9.3f} s {results[name]['peak_mib']:9.1f} MiB"
+                before = previous and previous["results"].get(name)
+                if before:
+                    line += f"   (was {before['best_s']:.3f} s, x{results[name]['best_s'] / before['best_s']:.2f})"
+                print(line, flush=True)
+
+        records.append({
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "scale": scale,
+            "n_cpg": data["n_cpg"],
+            "n_samples": list(n_samples),
+            "seed": seed,
+            "environment": environment,
+            "results": results,
+        })
+
+    history.extend(records)
+    pathlib.Path(history_path).write_text(json.dumps(history, indent=1))
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", default=["27k", "450k"],
+                        help="27k, 450k, 850k or a number of CpGs (default: 27k 450k)")
+    parser.add_argument("--cases", nargs="+", help="only run cases whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--samples", type=int, nargs=2, default=(8, 8), metavar=("N1", "N2"),
+                        help="samples per group")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON history file to append to")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("matplotlib.font_manager").setLevel(logging.ERROR)
+    run(args.scales, args.cases, args.repeat, tuple(args.samples), args.seed, args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Synthetic methylation datasets at Illumina array scale.
+
+Everything is generated from a seed, so benchmark runs are reproducible and
+need no network access. The layouts follow what the package reads from
+ArrayExpress/GEO: an SDRF file, one ``<GSM>_sample_table.txt`` per sample and
+a merged statistics frame annotated with ``Chromosome``, ``Position`` and
+``Gene Name``.
+"""
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+SCALES = {
+    "27k": 27_578,
+    "450k": 485_577,
+    "850k": 866_836,
+}
+
+CHROMOSOMES = [str(c) for c in range(1, 23)] + ["X", "Y"]
+# Approximate share of array probes per chromosome (chr1 … chr22, X, Y).
+_CHROMOSOME_WEIGHTS = np.array([
+    10.2, 7.3, 5.4, 4.2, 5.2, 6.9, 5.9, 4.4, 2.2, 5.2, 6.0, 5.3,
+    2.6, 3.2, 3.2, 4.7, 6.2, 1.4, 5.6, 2.2, 0.9, 1.9, 2.3, 0.1,
+])
+_CHROMOSOME_LENGTHS = np.array([
+    249, 242, 198, 190, 181, 171, 159, 145, 138, 134, 135, 133,
+    114, 107, 102, 90, 83, 80, 59, 64, 47, 51, 156, 57,
+]) * 1_000_000
+
+
+def n_cpg_for(scale):
+    """Number of CpGs for a scale name (``"27k"``, ``"450k"``, ``"850k"``) or an integer."""
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(scale)
+
+
+def make_manifest(n_cpg, seed=0, gene_fraction=0.6, mean_gene_size=12):
+    """Probe annotation sorted by chromosome and position.
+
+    Genes are runs of neighbouring CpGs (``mean_gene_size`` on average);
+    about ``1 - gene_fraction`` of the probes are left without a gene.
+    """
+    rng = np.random.default_rng(seed)
+    weights = _CHROMOSOME_WEIGHTS / _CHROMOSOME_WEIGHTS.sum()
+    counts = rng.multinomial(n_cpg, weights)
+
+    chromosomes, positions = [], []
+    for chrom, count, length in zip(CHROMOSOMES, counts, _CHROMOSOME_LENGTHS):
+        chromosomes.append(np.full(count, chrom, dtype=object))
+        positions.append(np.sort(rng.choice(length, size=count, replace=False)))
+    chromosomes = np.concatenate(chromosomes)
+    positions = np.concatenate(positions)
+
+    run_lengths = rng.geometric(1.0 / mean_gene_size, size=n_cpg // 2 + 1)
+    run_of_row = np.repeat(np.arange(len(run_lengths)), run_lengths)[:n_cpg]
+    annotated = rng.random(len(run_lengths)) < gene_fraction
+    genes = np.where(annotated[run_of_row], np.char.add("GENE", run_of_row.astype(str)), None)
+
+    return pd.DataFrame({
+        "Predictor": np.char.add("cg", np.char.zfill(rng.permutation(n_cpg).astype(str), 8)),
+        "Chromosome": chromosomes,
+        "Position": positions.astype(np.int64),
+        "Gene Name": genes,
+    })
+
+
+def make_baseline(n_cpg, seed=0):
+    """Per-CpG mean β-values, bimodal as on real arrays."""
+    rng = np.random.default_rng(seed)
+    low = rng.random(n_cpg) < 0.5
+    return np.where(low, rng.beta(1.5, 12, n_cpg), rng.beta(12, 1.5, n_cpg))
+
+
+def make_betas(baseline, n_samples, seed=0, missing=0.001):
+    """``(len(baseline), n_samples)`` float32 β-values scattered around *baseline*.
+
+    A ``missing`` fraction of the values is NaN.
+    """
+    rng = np.random.default_rng(seed)
+    betas = np.clip(baseline[:, None] + rng.normal(0.0, 0.03, (len(baseline), n_samples)), 0.0, 1.0)
+    betas[rng.random(betas.shape) < missing] = np.nan
+    return betas.astype(np.float32)
+
+
+def make_groups(manifest, n_samples=(8, 8), seed=0, shift_fraction=0.01, shift=0.2):
+    """CpG × samples frames indexed by probe ID, as from ``build_methylome_dataframes``.
+
+    All groups share one baseline. Every group after the first is moved by
+    *shift* (towards the other mode) on the same ``shift_fraction`` of the
+    CpGs, which are thus the only differentially methylated ones.
+    """
+    base_seed, shift_seed, *seeds = np.random.SeedSequence(seed).spawn(len(n_samples) + 2)
+    baseline = make_baseline(len(manifest), seed=base_seed)
+    shifted = np.random.default_rng(shift_seed).random(len(manifest)) < shift_fraction
+    moved = np.clip(baseline + np.where(shifted, np.where(baseline < 0.5, shift, -shift), 0.0), 0.0, 1.0)
+    frames = []
+    first = 0
+    for k, (size, group_seed) in enumerate(zip(n_samples, seeds)):
+        betas = make_betas(moved if k else baseline, size, seed=group_seed)
+        columns = [f"GSM{900000 + first + j}" for j in range(size)]
+        frames.append(pd.DataFrame(betas, index=pd.Index(manifest["Predictor"], name="Reporter Identifier"),
+                                   columns=columns))
+        first += size
+    return tuple(frames)
+
+
+def make_merged(manifest, seed=0):
+    """Annotated statistics frame as returned by ``Preprocessing.merge``.
+
+    Carries ``pvalue``, ``delta`` and ``log10_pvalue``; CpGs inside a few
+    genes get small p-values so that smoothing and peak calling have signal to
+    find.
+    """
+    rng = np.random.default_rng(seed)
+    n_cpg = len(manifest)
+    pvalue = rng.random(n_cpg)
+    genes = manifest["Gene Name"].to_numpy()
+    hits = pd.unique(genes[pd.notna(genes)])[::97]
+    in_hit = pd.Series(genes).isin(hits).to_numpy()
+    pvalue[in_hit] = pvalue[in_hit] ** 8
+
+    merged = manifest.copy()
+    merged.insert(1, "pvalue", pvalue)
+    merged.insert(2, "delta", rng.normal(0.0, 0.05, n_cpg))
+    merged["log10_pvalue"] = -np.log10(pvalue)
+    return merged
+
+
+def busiest_gene(merged):
+    """Gene with the most CpGs, used as the target of the per-gene benchmarks."""
+    return merged["Gene Name"].value_counts().index[0]
+
+
+def write_dataset(out_dir, manifest, groups, names=("Newborns", "Nonagenarians")):
+    """Write an SDRF and one sample table per sample under *out_dir*.
+
+    Returns the SDRF path and the sample directory, ready for
+    ``build_methylome_dataframes(sdrf_path, sample_dir, groups=names)``.
+    """
+    out_dir = pathlib.Path(out_dir)
+    sample_dir = out_dir / "samples"
+    sample_dir.mkdir(parents=True, exist_ok=True)
+
+    rows = []
+    for name, frame in zip(names, groups):
+        for sample_id in frame.columns:
+            rows.append({"Source Name": f"{sample_id} 1", "Comment [Sample_source_name]": name})
+            table = pd.DataFrame({"Reporter Identifier": frame.index, "VALUE": frame[sample_id].to_numpy()})
+            table.to_csv(sample_dir / f"{sample_id}_sample_table.txt", sep="\t", index=False, float_format="%.6g")
+
+    sdrf_path = out_dir / "sdrf.txt"
+    pd.DataFrame(rows).to_csv(sdrf_path, sep="\t", index=False)
+    return sdrf_path, sample_dir